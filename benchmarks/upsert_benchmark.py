@@ -0,0 +1,107 @@
+'''
+Benchmark of the two upsert paths of DBUtils on a synthetic daily_options-like DataFrame:
+executemany batches (UpdateInsertTable) against LOAD DATA LOCAL INFILE + staging table (BulkUpsertTable).
+Each path runs twice on a scratch table: first run inserts every row, second run updates every row.
+With --backend duckdb the native ON CONFLICT upsert of DuckDBUtils is timed instead, without any DB server.
+With --serialisation only the client side of the two MariaDB paths is timed, without any DB server:
+building the parameter dicts of every batch against writing the escaped tab-separated file.
+
+Run from the repo root: python -m benchmarks.upsert_benchmark --rows 100000 [--backend duckdb] [--serialisation]
+'''
+import os, csv, time, argparse, tempfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utils.utils import nan_to_none
+from data_ingestion.db_utils import TABLES_DATA_TYPES, escaping_load_data
+from data_ingestion.storage import get_backend
+
+
+def building_frame(n_rows, seed = 0):
+    '''
+    Function that builds a DataFrame with the same columns of daily_options and n_rows unique primary keys.
+    '''
+    rng = np.random.default_rng(seed)
+    n_strikes = n_rows // 2
+    df = pd.DataFrame({
+        'delta': rng.uniform(-1, 1, n_rows),
+        'volume': rng.integers(0, 1000, n_rows).astype(float),
+        'bid': rng.uniform(0, 500, n_rows).round(1),
+        'median_price': rng.uniform(0, 500, n_rows).round(1),
+        'ask': rng.uniform(0, 500, n_rows).round(1),
+        'open_interest': rng.integers(0, 10000, n_rows).astype(float),
+        'price': rng.uniform(0, 500, n_rows).round(1),
+        'strike': np.tile(np.arange(n_strikes) * 25, 2),
+        'option_type': np.repeat(['C', 'P'], n_strikes),
+        })
+    # Missing values as in the real option ruler
+    df.loc[rng.random(n_rows) < 0.1, 'bid'] = np.nan
+    df['insert_date'] = '2022-03-31'
+    df['update_time'] = datetime.now()
+    df['expiration_date'] = 'SET22'
+
+    return df
+
+
+def timing(db_class, method, table_name):
+    start = time.perf_counter()
+    stats = getattr(db_class, method)(table_name)
+    return time.perf_counter() - start, stats
+
+
+def timing_serialisation(df, batch_size = 1000):
+    '''
+    Function that times the client side of UpdateInsertTable (parameter dicts of every batch) and of BulkUpsertTable (tab-separated file).
+    '''
+    start = time.perf_counter()
+    for batch_start in range(0, len(df), batch_size):
+        nan_to_none(df.iloc[batch_start:batch_start + batch_size]).to_dict(orient='records')
+    elapsed_records = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8') as tmp_file:
+        escaping_load_data(df).to_csv(tmp_file, sep='\t', na_rep='\\N', header=False, index=False, quoting=csv.QUOTE_NONE, date_format='%Y-%m-%d %H:%M:%S')
+    elapsed_file = time.perf_counter() - start
+    os.remove(tmp_file.name)
+
+    return elapsed_records, elapsed_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark UpdateInsertTable against BulkUpsertTable')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--schema', default='directa')
+    parser.add_argument('--backend', default='mariadb', choices=['mariadb', 'duckdb'])
+    parser.add_argument('--serialisation', action='store_true', help='time only the client side of the MariaDB paths, without any DB server')
+    args = parser.parse_args()
+
+    df = building_frame(args.rows)
+    if args.serialisation:
+        elapsed_records, elapsed_file = timing_serialisation(df)
+        print('Client side, {0} rows: UpdateInsertTable parameter dicts {1:.2f}s, BulkUpsertTable tab-separated file {2:.2f}s'.format(
+            args.rows, elapsed_records, elapsed_file
+            ))
+        raise SystemExit
+    sql_pk = ["strike", "insert_date", "expiration_date", "option_type"]
+
+    methods = ['UpdateInsertTable', 'BulkUpsertTable'] if args.backend == 'mariadb' else ['UpdateInsertTable']
+    for method in methods:
+        table_name = 'benchmark_{}'.format(method.lower())
+        db_class = get_backend(args.backend, args.schema, df, save_log=False)
+        db_class.LoadTable(table_name, pk = sql_pk, data_types=TABLES_DATA_TYPES['daily_options'])
+        if args.backend == 'mariadb':
+            with db_class.engine.begin() as con:
+                con.exec_driver_sql('TRUNCATE TABLE `{}`'.format(table_name))
+        else:
+            db_class.con.execute('DELETE FROM {}'.format(db_class._table(table_name)))
+        elapsed_insert, stats_insert = timing(db_class, method, table_name)
+        db_class.pandas_df = df.assign(update_time=datetime.now(), median_price=df['median_price'] + 1)
+        elapsed_update, stats_update = timing(db_class, method, table_name)
+        if args.backend == 'mariadb':
+            with db_class.engine.begin() as con:
+                con.exec_driver_sql('DROP TABLE `{}`'.format(table_name))
+        else:
+            db_class.con.execute('DROP TABLE {}'.format(db_class._table(table_name)))
+        print('{0} ({6}): {1} rows, insert {2:.2f}s {3}, update {4:.2f}s {5}'.format(
+            method, args.rows, elapsed_insert, stats_insert, elapsed_update, stats_update, args.backend
+            ))
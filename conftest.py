@@ -0,0 +1 @@
+# Keeps the repository root on sys.path, so that the tests import utils and data_ingestion when run with a bare 'pytest'
@@ -0,0 +1,231 @@
+import os, sys, glob, pickle
+from datetime import date
+import pandas as pd
+from utils.utils import MyLogger, mkdir_p, save_to_pickle, frame_hash
+from data_ingestion.storage import get_backend
+
+
+# Folder where PositionAnalytics caches the option ruler history of each expiration date
+HISTORY_CACHE_DIR = 'data/analytics'
+
+
+def removing_history_cache(cache_dir = HISTORY_CACHE_DIR):
+    '''
+    Function that deletes the option ruler history cached for every expiration date, so that it is read again from the DB as a whole.
+    To be called whenever daily_options gets snapshots older than the cached ones (e.g. a backfill), which the incremental refresh would miss.
+
+    :param cache_dir: folder where the history is cached
+    :type: str
+    :return: number of cache files deleted
+    :rtype: int
+    '''
+    cache_files = glob.glob(os.path.join(cache_dir, 'options_history_*.pkl'))
+    for cache_file in cache_files:
+        os.remove(cache_file)
+
+    return len(cache_files)
+
+
+class PositionAnalytics:
+
+    '''
+    ## Position analytics of queries/time_decay.sql computed with vectorized pandas joins instead of tempdb temporary tables:
+    delta by trade date (tmp_options), profit by expiration date (options_estimation) and time decay between the first and last snapshot.
+    The option ruler history of each expiration date is cached on disk and, at each refresh, only the snapshots loaded since the last one are read.
+    Results are cached in memory per snapshot date, so that a refresh recomputes only the new snapshots.
+    '''
+
+    # Columns of daily_options needed by the analytics
+    HISTORY_COLS = ['strike', 'option_type', 'insert_date', 'median_price', 'delta']
+    # Columns joining option prices and open positions
+    JOIN_COLS = ['strike', 'option_type']
+    # Value of one index point of the options, as in time_decay.sql
+    MULTIPLIER = 10
+
+    def __init__(self, table_schema = 'directa', backend = 'mariadb', cache_dir = HISTORY_CACHE_DIR, save_log = True):
+        '''
+        Constructor method
+
+        :param backend: storage backend the tables are read from, either 'mariadb' or 'duckdb'
+        :type: str
+        :param cache_dir: folder where the option ruler history of each expiration date is cached
+        :type: str
+        '''
+        self.db = get_backend(backend, table_schema, pd.DataFrame(), save_log=save_log)
+        self.cache_dir = cache_dir
+        # Option ruler history per expiration date and results per (view, key)
+        self._history = {}
+        self._results = {}
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/analytics.log', name='analytics')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='analytics')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def _history_path(self, expiration_date):
+        '''
+        Path of the file caching the option ruler history of the expiration date.
+        '''
+        return os.path.join(self.cache_dir, 'options_history_{}.pkl'.format(expiration_date))
+
+    def reading_positions(self):
+        '''
+        Function that reads the open positions from the DB.
+
+        :return: open_position_options table
+        :rtype: pandas.DataFrame
+        '''
+        return self.db.ReadTable('open_position_options')
+
+    def reading_calendar(self):
+        '''
+        Function that reads the calendar prices from the DB.
+
+        :return: calendar_options table
+        :rtype: pandas.DataFrame
+        '''
+        df_calendar = self.db.ReadTable('calendar_options')
+        df_calendar['insert_date'] = pd.to_datetime(df_calendar['insert_date'])
+
+        return df_calendar
+
+    def options_history(self, expiration_date):
+        '''
+        Function that returns the option ruler history of the expiration date, one row per snapshot, strike and option type.
+        Only the snapshots from the last cached one onwards are read, the last cached one being read again since it may have been refreshed
+        by a later run of the same day. Older snapshots loaded afterwards are not seen until the cache is removed (see removing_history_cache).
+
+        :param expiration_date: expiration date as stored in daily_options, e.g. 'GIU22'
+        :type: str
+        :return: DataFrame with columns HISTORY_COLS, insert_date as datetime
+        :rtype: pandas.DataFrame
+        '''
+        history = self._history.get(expiration_date)
+        if history is None and os.path.isfile(self._history_path(expiration_date)):
+            with open(self._history_path(expiration_date), 'rb') as f:
+                history = pickle.load(f)
+
+        last_date = None if history is None or history.empty else history['insert_date'].max()
+        df_new = self.db.ReadTable('daily_options', expiration_date=expiration_date, start_date=last_date, columns=self.HISTORY_COLS)
+        df_new['insert_date'] = pd.to_datetime(df_new['insert_date'])
+        if last_date is not None:
+            df_new = pd.concat([history[history['insert_date'] < last_date], df_new], ignore_index=True)
+        history = df_new.sort_values(['insert_date', 'option_type', 'strike'], ignore_index=True)
+
+        mkdir_p(self._history_path(expiration_date))
+        save_to_pickle(history, self._history_path(expiration_date))
+        self._history[expiration_date] = history
+        self._logging.info("Options history of {0}: {1} snapshots, {2} rows".format(expiration_date, history['insert_date'].nunique(), len(history)))
+
+        return history
+
+    def merging_positions(self, df_options, df_positions):
+        '''
+        Function that joins option prices and open positions on strike and option type, as tempdb.tmp_options.
+
+        :param df_options: option prices, with columns HISTORY_COLS
+        :type: pandas.DataFrame
+        :param df_positions: open positions, as in open_position_options
+        :type: pandas.DataFrame
+        :return: one row per snapshot and position
+        :rtype: pandas.DataFrame
+        '''
+        return df_options[self.HISTORY_COLS].merge(df_positions, on=self.JOIN_COLS, how='inner')
+
+    def delta_by_trade_date(self, expiration_date, df_positions = None):
+        '''
+        Function that sums the delta of the options in portfolio at each snapshot of the expiration date.
+        Snapshots already computed for the same positions are taken from the cache, only the new ones are joined and aggregated.
+
+        :param expiration_date: expiration date as stored in daily_options, e.g. 'GIU22'
+        :type: str
+        :param df_positions: open positions. Default is None, meaning the ones stored on DB
+        :type: pandas.DataFrame
+        :return: delta indexed by trade_date
+        :rtype: pandas.Series
+        '''
+        df_positions = self.reading_positions() if df_positions is None else df_positions
+        history = self.options_history(expiration_date)
+        cache_key = ('delta_by_trade_date', expiration_date, frame_hash(df_positions[self.JOIN_COLS]))
+
+        cached = self._results.get(cache_key)
+        start_date = None if cached is None or cached.empty else cached.index.max()
+        df_new = history if start_date is None else history[history['insert_date'] >= start_date]
+        delta = self.merging_positions(df_new, df_positions).groupby('insert_date')['delta'].sum()
+        if start_date is not None:
+            delta = pd.concat([cached[cached.index < start_date], delta])
+        delta = delta.rename_axis('trade_date')
+
+        self._results[cache_key] = delta
+        self._logging.info("Delta by trade date of {0} computed for {1} new snapshots".format(expiration_date, df_new['insert_date'].nunique()))
+
+        return delta
+
+    def profit_by_expiration(self, df_positions = None, df_calendar = None):
+        '''
+        Function that estimates the profit of the open positions at the expiration dates of the calendar, supposing market prices
+        will keep constant in future, as tempdb.options_estimation. Results are cached per calendar snapshot and positions.
+
+        :param df_positions: open positions. Default is None, meaning the ones stored on DB
+        :type: pandas.DataFrame
+        :param df_calendar: calendar prices. Default is None, meaning the ones stored on DB
+        :type: pandas.DataFrame
+        :return: profit by granular split (expiration date, strike, option type, qty, purchase and expiration prices)
+            and profit by expiration date and purchase date, with days to expiration
+        :rtype: tuple
+        '''
+        df_positions = self.reading_positions() if df_positions is None else df_positions
+        df_calendar = self.reading_calendar() if df_calendar is None else df_calendar
+        cache_key = ('profit_by_expiration', frame_hash(df_positions), frame_hash(df_calendar))
+        if cache_key in self._results:
+            return self._results[cache_key]
+
+        df_estimation = df_positions[['price', 'qty', 'strike', 'option_type', 'purchase_date', 'expiration_date']].merge(
+            df_calendar[['price', 'strike', 'option_type', 'expiration_date']], on=self.JOIN_COLS, how='inner', suffixes=('_purchase', '')
+            ).rename(columns={'price_purchase': 'purchase_price', 'price': 'price_expiration_date', 'expiration_date_purchase': 'purchase_expiration_date'})
+        df_estimation['profit'] = (df_estimation['purchase_price'] - df_estimation['price_expiration_date']) * (-df_estimation['qty']) * self.MULTIPLIER
+
+        df_granular = df_estimation.groupby(
+            ['expiration_date', 'strike', 'option_type', 'qty', 'purchase_price', 'price_expiration_date'], as_index=False, dropna=False
+            )['profit'].sum()
+        df_expiration = df_estimation.groupby(['expiration_date', 'purchase_date'], as_index=False)['profit'].sum()
+        df_expiration.insert(2, 'days_to_expiration', (pd.to_datetime(df_expiration['expiration_date']) - pd.Timestamp(date.today())).dt.days)
+
+        self._results[cache_key] = (df_granular, df_expiration)
+        self._logging.info("Profit estimated for {0} positions over {1} expiration dates".format(len(df_positions), df_expiration['expiration_date'].nunique()))
+
+        return df_granular, df_expiration
+
+    def time_decay(self, expiration_date):
+        '''
+        Function that compares the median price of each strike and option type between the first and the last snapshot of the expiration date.
+        Results are cached per pair of snapshots.
+
+        :param expiration_date: expiration date as stored in daily_options, e.g. 'GIU22'
+        :type: str
+        :return: one row per strike and option type of the last snapshot, with absolute and percentage difference of the median price
+        :rtype: pandas.DataFrame
+        '''
+        history = self.options_history(expiration_date)
+        first_date, last_date = history['insert_date'].min(), history['insert_date'].max()
+        cache_key = ('time_decay', expiration_date, first_date, last_date)
+        if cache_key in self._results:
+            return self._results[cache_key]
+
+        snapshot_cols = ['strike', 'option_type', 'median_price', 'insert_date']
+        df_decay = history.loc[history['insert_date'] == last_date, snapshot_cols].merge(
+            history.loc[history['insert_date'] == first_date, snapshot_cols], on=self.JOIN_COLS, how='left', suffixes=('_last', '_first')
+            ).rename(columns={
+                'median_price_last': 'last_median_price', 'insert_date_last': 'last_insert_date',
+                'median_price_first': 'first_median_price', 'insert_date_first': 'first_insert_date'
+                })
+        df_decay['abs_diff_median_price'] = df_decay['last_median_price'] - df_decay['first_median_price']
+        df_decay['perc_diff_median_price'] = df_decay['abs_diff_median_price'] / df_decay['last_median_price']
+
+        self._results[cache_key] = df_decay
+        self._logging.info("Time decay of {0} computed between {1} and {2}".format(expiration_date, first_date, last_date))
+
+        return df_decay
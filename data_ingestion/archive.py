@@ -0,0 +1,188 @@
+import os, sys, json, shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+from utils.utils import MyLogger, mkdir_p
+
+
+# File of each raw snapshot folder recording what the raw files cannot tell by themselves, e.g. the expiration date of the greeks file
+SNAPSHOT_INFO_FILE = 'snapshot_info.json'
+
+
+def reading_snapshot_info(snapshot_dir):
+    '''
+    Function that reads the information recorded with SnapshotArchive.archiving_snapshot_info for a raw snapshot folder.
+
+    :param snapshot_dir: raw snapshot folder, e.g. data/archive/raw/2022-03-31
+    :type: str
+    :return: recorded information, empty if the snapshot has been archived before it was recorded
+    :rtype: dict
+    '''
+    info_path = os.path.join(snapshot_dir, SNAPSHOT_INFO_FILE)
+    if not os.path.isfile(info_path):
+        return {}
+    with open(info_path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+class SnapshotArchive:
+
+    '''
+    ## Keep every snapshot instead of overwriting data/*.csv at each run.
+    Cleaned frames are stored as Parquet, one dataset per table partitioned by insert_date and expiration_date:
+
+        <archive_dir>/clean/<table_name>/insert_date=2022-03-31/expiration_date=SET22/part-0.parquet
+
+    Raw files are copied as they are, following the layout read by data_ingestion.backfill:
+
+        <archive_dir>/raw/2022-03-31/options_table.csv
+        <archive_dir>/raw/2022-03-31/snapshot_info.json
+    '''
+
+    PARTITION_COLS = ['insert_date', 'expiration_date']
+
+    def __init__(self, archive_dir = 'data/archive', save_log = True):
+        '''
+        Constructor method
+        '''
+        self.archive_dir = archive_dir
+        # Partition values are stored as strings: dates as yyyy-mm-dd, so that date ranges can be compared as strings
+        self.partitioning = ds.partitioning(pa.schema([(col, pa.string()) for col in self.PARTITION_COLS]), flavor='hive')
+        # Files are memory-mapped when read
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/archive.log', name='archive')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='archive')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    @staticmethod
+    def _partition_value(column):
+        '''
+        Function that formats a partition column as strings, dates as yyyy-mm-dd.
+        '''
+        if pd.api.types.is_datetime64_any_dtype(column):
+            return column.dt.strftime('%Y-%m-%d')
+        return column.astype(str)
+
+    def writing(self, table_name, df):
+        '''
+        Function that writes a cleaned DataFrame in the Parquet dataset of the table. Partitions already holding the insert_date and
+        expiration_date of the DataFrame are replaced, so that running the ingestion again on the same day does not duplicate rows.
+        Tables without insert_date (e.g. open_position_options) are partitioned by the date of update_time.
+
+        :param table_name: name of the table the DataFrame belongs to, e.g. daily_options
+        :type: str
+        :param df: cleaned DataFrame returned by one of the DirectaDataPull.cleaning_* functions
+        :type: pandas.DataFrame
+        :return: None
+        '''
+        df_archive = df.copy()
+        if 'insert_date' not in df_archive.columns:
+            df_archive['insert_date'] = pd.to_datetime(df_archive['update_time'])
+        for col in self.PARTITION_COLS:
+            df_archive[col] = self._partition_value(df_archive[col])
+        # Categorical columns are stored as plain strings, so that files written by different runs share the same schema
+        for col in df_archive.columns[df_archive.dtypes == 'category']:
+            df_archive[col] = df_archive[col].astype(str)
+
+        table_dir = os.path.join(self.archive_dir, 'clean', table_name)
+        ds.write_dataset(
+            pa.Table.from_pandas(df_archive, preserve_index=False), table_dir, format='parquet',
+            partitioning=self.partitioning, existing_data_behavior='delete_matching', basename_template='part-{i}.parquet'
+            )
+        self._logging.info("{0} rows of table {1} archived in {2}".format(len(df_archive), table_name, table_dir))
+
+    def archiving_raw_file(self, file_path, snapshot_date, sub_folder = ''):
+        '''
+        Function that copies a raw file downloaded during the session in the raw archive.
+
+        :param file_path: path of the raw file, e.g. data/options_table.csv
+        :type: str
+        :param snapshot_date: date of the snapshot, format 'yyyy-mm-dd'
+        :type: str
+        :param sub_folder: sub folder of the snapshot folder, e.g. 'greeks'. Default is ''
+        :type: str
+        :return: path of the archived file
+        :rtype: str
+        '''
+        archived_path = os.path.join(self.archive_dir, 'raw', snapshot_date, sub_folder, os.path.basename(file_path))
+        mkdir_p(archived_path)
+        shutil.copy2(file_path, archived_path)
+        self._logging.info("Raw file {0} archived in {1}".format(file_path, archived_path))
+
+        return archived_path
+
+    def archiving_snapshot_info(self, snapshot_date, **info):
+        '''
+        Function that records the parameters of the session the raw files of the snapshot depend on, so that data_ingestion.backfill
+        cleans each snapshot with its own parameters instead of the ones given on the command line. Values already recorded are overwritten.
+
+        :param snapshot_date: date of the snapshot, format 'yyyy-mm-dd'
+        :type: str
+        :param info: values to record, e.g. expiration_date='SET22' (expiration of options_table.csv and of the greeks file) and purchase_date='2022-03-31'
+        :return: path of the information file
+        :rtype: str
+        '''
+        snapshot_dir = os.path.join(self.archive_dir, 'raw', snapshot_date)
+        info_path = os.path.join(snapshot_dir, SNAPSHOT_INFO_FILE)
+        snapshot_info = reading_snapshot_info(snapshot_dir)
+        snapshot_info.update(info)
+        mkdir_p(info_path)
+        with open(info_path, 'w', encoding='utf-8') as fp:
+            json.dump(snapshot_info, fp, ensure_ascii=False, indent=4)
+        self._logging.info("Snapshot information {0} recorded in {1}".format(snapshot_info, info_path))
+
+        return info_path
+
+    def reading(self, table_name, start_date = None, end_date = None, expiration_dates = None, min_strike = None, max_strike = None, columns = None):
+        '''
+        Function that reads the archived snapshots of a table. Date and expiration filters prune whole partitions,
+        the strike filter is pushed down to the Parquet row groups, and only the requested columns are read.
+
+        :param table_name: name of the table, e.g. daily_options
+        :type: str
+        :param start_date: first insert_date to read, format 'yyyy-mm-dd'. Default is None, meaning no lower bound
+        :type: str
+        :param end_date: last insert_date to read, format 'yyyy-mm-dd'. Default is None, meaning no upper bound
+        :type: str
+        :param expiration_dates: expiration dates to read, as stored in the partitions (e.g. ['SET22'] or ['2022-09-16']). Default is None, meaning all
+        :type: list
+        :param min_strike: lowest strike to read. Default is None, meaning no lower bound
+        :type: float
+        :param max_strike: highest strike to read. Default is None, meaning no upper bound
+        :type: float
+        :param columns: columns to read. Default is None, meaning all
+        :type: list
+        :return: archived snapshots matching the filters
+        :rtype: pandas.DataFrame
+        '''
+        dataset = ds.dataset(
+            os.path.join(self.archive_dir, 'clean', table_name), format='parquet',
+            partitioning=self.partitioning, filesystem=self.filesystem
+            )
+
+        filters = []
+        if start_date is not None:
+            filters.append(ds.field('insert_date') >= start_date)
+        if end_date is not None:
+            filters.append(ds.field('insert_date') <= end_date)
+        if expiration_dates is not None:
+            filters.append(ds.field('expiration_date').isin(expiration_dates))
+        if min_strike is not None:
+            filters.append(ds.field('strike') >= min_strike)
+        if max_strike is not None:
+            filters.append(ds.field('strike') <= max_strike)
+
+        filter_expression = None
+        for expression in filters:
+            filter_expression = expression if filter_expression is None else filter_expression & expression
+
+        df = dataset.to_table(columns=columns, filter=filter_expression).to_pandas()
+        self._logging.info("{0} rows of table {1} read from the archive".format(len(df), table_name))
+
+        return df
@@ -0,0 +1,227 @@
+import os, sys, glob, argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from utils.utils import MyLogger
+from data_ingestion.db_utils import TABLES_DATA_TYPES
+from data_ingestion.storage import get_backend
+from data_ingestion.directa_data_pull import DirectaDataPull
+from data_ingestion.archive import reading_snapshot_info
+from data_ingestion.analytics import removing_history_cache
+
+
+# Raw csv files, relative to a snapshot folder, feeding each table
+SNAPSHOT_FILES = {
+    'daily_options': 'options_table*.csv',
+    'open_position_options': 'tabellone*.csv',
+    'calendar_options': 'options_calendar*.csv',
+    'greeks_options': 'greeks/*.csv',
+    }
+
+
+def _cleaning_snapshot(table_name, csv_path, snapshot_date, pull_kwargs, snapshot_info):
+    '''
+    Worker function that cleans one archived raw csv file in a separate process, without opening any web session.
+
+    :param table_name: table the csv file belongs to, one of SNAPSHOT_FILES keys
+    :type: str
+    :param csv_path: path of the raw csv file
+    :type: str
+    :param snapshot_date: date of the snapshot, format 'yyyy-mm-dd'
+    :type: str
+    :param pull_kwargs: keyword arguments used to build the DirectaDataPull object in the worker process
+    :type: dict
+    :param snapshot_info: parameters of the session the snapshot was captured in: expiration_date (e.g. 'SET22') of options_table.csv
+        and of the greeks file, purchase_date ('yyyy-mm-dd') of the 'tabellone' file
+    :type: dict
+    :return: table name, cleaned dataframe and its primary key
+    :rtype: tuple
+    '''
+    pull_obj = DirectaDataPull(**pull_kwargs)
+
+    if table_name == 'daily_options':
+        # options_table_<EXP>.csv files carry their expiration date in the name
+        csv_name = os.path.basename(csv_path)
+        expiration_date = csv_name[len('options_table_'):-len('.csv')] if csv_name.startswith('options_table_') else snapshot_info['expiration_date']
+        df, sql_pk = pull_obj.cleaning_options_data(
+            csv_name, expiration_date=expiration_date, data_folder=os.path.dirname(csv_path), snapshot_date=snapshot_date, save_files=False
+            )
+    elif table_name == 'open_position_options':
+        df, sql_pk = pull_obj.cleaning_tabellone_data(purchase_date=snapshot_info['purchase_date'], csv_path=csv_path)
+    elif table_name == 'calendar_options':
+        df, sql_pk = pull_obj.cleaning_calendar_data(csv_path=csv_path, snapshot_date=snapshot_date, save_files=False)
+    else:
+        df, sql_pk = pull_obj.cleaning_greeks_data(csv_path=csv_path, snapshot_date=snapshot_date, expiration_date=snapshot_info['expiration_date'])
+
+    return table_name, df, sql_pk
+
+
+class SnapshotBackfill:
+
+    '''
+    ## Replay the cleaning stage over archived raw snapshots and bulk-load the results on the DB, without opening any web session.
+    The archive is expected to contain one folder per snapshot date, each holding the raw files as downloaded by DirectaDataPull:
+
+        <archive_dir>/2022-03-31/options_table.csv (or options_table_<EXP>.csv)
+        <archive_dir>/2022-03-31/tabellone.csv
+        <archive_dir>/2022-03-31/options_calendar.csv
+        <archive_dir>/2022-03-31/greeks/<barchart file>.csv
+        <archive_dir>/2022-03-31/snapshot_info.json
+
+    snapshot_info.json, written by SnapshotArchive.archiving_snapshot_info, holds the expiration date of interest and the purchase date
+    of the session, so that an archive spanning a roll is cleaned with the right expiration date for each snapshot. Snapshots archived
+    without it fall back to the expiration date and purchase date given to the constructor.
+
+    Run it as a module from the repository root, so that the data_ingestion and utils packages are importable:
+
+        python -m data_ingestion.backfill data/archive/raw --backend duckdb
+    '''
+
+    def __init__(self, archive_dir, expiration_date_of_interest = 'GIU22', symbol = 'FXM22', purchase_date = None, max_workers = None, save_log = True):
+        '''
+        Constructor method
+        '''
+        self.archive_dir = archive_dir
+        self.expiration_date_of_interest = expiration_date_of_interest
+        self.purchase_date = purchase_date
+        self.max_workers = max_workers
+        # Worker processes log only on console, so that they don't compete on the same log file
+        self.pull_kwargs = {'save_log': False, 'expiration_date_of_interest': expiration_date_of_interest, 'symbol': symbol}
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/backfill.log', name='backfill')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='backfill')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def reading_snapshot_info(self, snapshot_dir):
+        '''
+        Function that returns the expiration date and purchase date the snapshot has been captured with, falling back to the ones
+        given to the constructor when they have not been recorded.
+
+        :param snapshot_dir: raw snapshot folder
+        :type: str
+        :return: dict with expiration_date and purchase_date
+        :rtype: dict
+        '''
+        recorded_info = reading_snapshot_info(snapshot_dir)
+        snapshot_info = {
+            'expiration_date': recorded_info.get('expiration_date', self.expiration_date_of_interest),
+            'purchase_date': recorded_info.get('purchase_date', self.purchase_date),
+            }
+        missing = [key for key in snapshot_info if key not in recorded_info]
+        if missing:
+            self._logging.warning("{0} not recorded for snapshot {1}, using {2}".format(
+                missing, os.path.basename(snapshot_dir), {key: snapshot_info[key] for key in missing}
+                ))
+
+        return snapshot_info
+
+    def listing_snapshots(self, tables = None):
+        '''
+        Function that lists every raw csv file in the archive, together with the table it feeds, its snapshot date and the session parameters.
+
+        :param tables: tables to replay. Default is None, meaning all the tables in SNAPSHOT_FILES
+        :type: list
+        :return: list of (table name, csv path, snapshot date, snapshot info) tuples
+        :rtype: list
+        '''
+        tables = list(SNAPSHOT_FILES.keys()) if tables is None else tables
+
+        snapshots = []
+        for snapshot_dir in sorted(glob.glob(os.path.join(self.archive_dir, '*'))):
+            if not os.path.isdir(snapshot_dir):
+                continue
+            snapshot_date = os.path.basename(snapshot_dir)
+            snapshot_info = self.reading_snapshot_info(snapshot_dir)
+            for table_name in tables:
+                for csv_path in sorted(glob.glob(os.path.join(snapshot_dir, SNAPSHOT_FILES[table_name]))):
+                    # Skipping files generated by the cleaning stage
+                    if not csv_path.endswith('_clean.csv'):
+                        snapshots.append((table_name, csv_path, snapshot_date, snapshot_info))
+
+        self._logging.info("{0} raw files found in {1}".format(len(snapshots), self.archive_dir))
+
+        return snapshots
+
+    def cleaning_snapshots(self, tables = None):
+        '''
+        Function that cleans every archived raw file, spreading the files across a process pool.
+
+        :param tables: tables to replay. Default is None, meaning all the tables in SNAPSHOT_FILES
+        :type: list
+        :return: dict having the table name as key and a tuple (cleaned dataframe, primary key) as value
+        :rtype: dict
+        '''
+        snapshots = self.listing_snapshots(tables)
+
+        dict_frames, dict_pk = {}, {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(_cleaning_snapshot, table_name, csv_path, snapshot_date, self.pull_kwargs, snapshot_info)
+                for table_name, csv_path, snapshot_date, snapshot_info in snapshots
+                ]
+            for (_, csv_path, _, _), future in zip(snapshots, futures):
+                try:
+                    table_name, df, sql_pk = future.result()
+                except Exception as e:
+                    self._logging.warning("Skipping {0}, cleaning failed with: {1}".format(csv_path, e))
+                    continue
+                dict_frames.setdefault(table_name, []).append(df)
+                dict_pk[table_name] = sql_pk
+
+        dict_tables = {}
+        for table_name, list_df in dict_frames.items():
+            # Latest snapshot wins when the same primary key shows up in more than one file
+            df = pd.concat(list_df, ignore_index=True).drop_duplicates(subset=dict_pk[table_name], keep='last')
+            self._logging.info("{0} rows cleaned for table {1}".format(len(df), table_name))
+            dict_tables[table_name] = (df, dict_pk[table_name])
+
+        return dict_tables
+
+    def loading_snapshots(self, table_schema = 'directa', tables = None, backend = 'mariadb'):
+        '''
+        Function that cleans every archived raw file and bulk-loads the results, one upsert per table
+        (BulkUpsertTable on MariaDB, UpdateInsertTable on DuckDB).
+
+        :param table_schema: DB schema where tables are stored. Default is 'directa'
+        :type: str
+        :param tables: tables to replay. Default is None, meaning all the tables in SNAPSHOT_FILES
+        :type: list
+        :param backend: storage backend, either 'mariadb' or 'duckdb'. Default is 'mariadb'
+        :type: str
+        :return: None
+        '''
+        for table_name, (df, sql_pk) in self.cleaning_snapshots(tables).items():
+            db_class = get_backend(backend, table_schema, df)
+            db_class.LoadTable(table_name, pk = sql_pk, data_types=TABLES_DATA_TYPES[table_name])
+            if backend == 'mariadb':
+                # Whole history of a table in one upsert, loaded with LOAD DATA instead of executemany batches
+                db_class.BulkUpsertTable(table_name)
+            else:
+                db_class.UpdateInsertTable(table_name)
+            # Archived rows may be older than the ones the row hashes describe, the next ingestion has to send every row again
+            db_class.InvalidateRowHashes(table_name)
+            if table_name == 'daily_options':
+                # Same for the option ruler history cached by the analytics, which is refreshed only from its last snapshot onwards
+                self._logging.info("{} cached options histories removed".format(removing_history_cache()))
+            self._logging.info("Table {0} backfilled".format(table_name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay the cleaning stage over archived raw snapshots and load them on the DB')
+    parser.add_argument('archive_dir', help='folder containing one sub-folder of raw files per snapshot date')
+    parser.add_argument('--expiration', default='GIU22', help='expiration date of interest, e.g. GIU22, for snapshots without snapshot_info.json')
+    parser.add_argument('--symbol', default='FXM22', help='BarChart.com symbol')
+    parser.add_argument('--purchase-date', default=None, help="purchase date for 'tabellone' files, format yyyy-mm-dd, for snapshots without snapshot_info.json")
+    parser.add_argument('--tables', nargs='*', default=None, choices=list(SNAPSHOT_FILES.keys()), help='tables to replay, all of them by default')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--backend', default='mariadb', choices=['mariadb', 'duckdb'], help='storage backend the snapshots are loaded into')
+    args = parser.parse_args()
+
+    backfill_obj = SnapshotBackfill(
+        args.archive_dir, expiration_date_of_interest=args.expiration, symbol=args.symbol,
+        purchase_date=args.purchase_date, max_workers=args.workers
+        )
+    backfill_obj.loading_snapshots(tables=args.tables, backend=args.backend)
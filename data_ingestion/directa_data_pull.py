@@ -1,5 +1,5 @@
 # import keyring, 
-import os, sys, glob
+import os, sys
 from pathlib import Path
 from utils.utils import MyLogger, round_nearest_base, is_venv, load_config
 import rpa as r
@@ -10,7 +10,12 @@ from datetime import datetime, date
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
 import locale
-from locale import atof
+from data_ingestion.download_capture import DownloadCapture
+from data_ingestion.exports import ExportWorker
+from data_ingestion.parsers import parse_option_ruler, parse_tabellone_description, parse_italian_numbers, parse_expiration_codes
+from data_ingestion.implied_vol import ImpliedVolSolver
+from data_ingestion.pricing import chain_greeks
+
 
 class DirectaDataPull:
 
@@ -18,13 +23,26 @@ class DirectaDataPull:
     ## Create a bot that automatically logins to https://www1.directatrading.com/dlogin/PdL3v14159/ using the credential provided in keyring file with SPACENAME as directa
     '''
 
-    def __init__(self, save_log = True, expiration_date_of_interest = 'GIU22', symbol = 'FXM22'):
+    def __init__(self, save_log = True, expiration_date_of_interest = 'GIU22', symbol = 'FXM22', readiness_timeout = 30, exports = ('csv', 'xlsx')):
         '''
         Constructor method
         '''
         self.save_log = save_log
         self.expiration_date_of_interest = expiration_date_of_interest
         self.symbol = symbol
+        # Maximum number of seconds to wait for a page element before moving on
+        self.readiness_timeout = readiness_timeout
+        # Seconds spent waiting on each navigation step, so slow page elements can be spotted in the logs
+        self.step_timings = {}
+        # Future value read from the option ruler header, per expiration date
+        self.futures = {}
+        # Greeks file downloaded from BarChart.com and its content hash
+        self.download_capture = DownloadCapture()
+        self.newest_file, self.greeks_hash, self.greeks_already_ingested = None, None, False
+        # Side files (csv/xlsx) declared for this run, written in background
+        self.export_worker = ExportWorker(formats=exports, save_log=save_log)
+        # Implied volatilities solved locally, warm-started from the previous snapshot of each expiration date
+        self.iv_solver = ImpliedVolSolver(save_log=save_log)
 
         # Setting the yearmonth text for BarChart.com query
         locale.setlocale(locale.LC_ALL, 'it_IT.UTF-8')
@@ -55,23 +73,211 @@ class DirectaDataPull:
 
         self._logging.info("Executable is {}".format(sys.executable))
 
-    def downloading_market_prices(self, session):
+    def waiting_until(self, step_name, condition, timeout = None, poll_interval = 0.25, backoff = 1.5, max_interval = 2):
+        '''
+        Function that polls a condition until it returns a truthy value or the timeout expires, instead of sleeping for a fixed amount of time.
+        The interval between two polls grows by the backoff factor up to max_interval. Time spent is logged and stored in self.step_timings.
+
+        :param step_name: name of the navigation step, used for logging the timings
+        :type: str
+        :param condition: callable with no arguments, the wait is over as soon as it returns a truthy value
+        :type: callable
+        :param timeout: maximum number of seconds to wait. Default is None, meaning self.readiness_timeout
+        :type: float
+        :param poll_interval: seconds to wait after the first unsuccessful poll
+        :type: float
+        :param backoff: multiplier applied to the interval after each unsuccessful poll
+        :type: float
+        :param max_interval: upper bound for the interval between two polls
+        :type: float
+        :return: value returned by condition, or None if the timeout expired
+        '''
+        timeout = self.readiness_timeout if timeout is None else timeout
+        interval = poll_interval
+        start = time.perf_counter()
+        while True:
+            result = condition()
+            elapsed = time.perf_counter() - start
+            if result:
+                self.step_timings[step_name] = elapsed
+                self._logging.info("Step '{0}' ready after {1:.2f} seconds".format(step_name, elapsed))
+                return result
+            if elapsed >= timeout:
+                self.step_timings[step_name] = elapsed
+                self._logging.warning("Step '{0}' not ready after {1:.2f} seconds, moving on".format(step_name, elapsed))
+                return None
+            time.sleep(min(interval, timeout - elapsed))
+            interval = min(interval * backoff, max_interval)
+
+    def waiting_for_element(self, session, xpaths, step_name, timeout = None):
+        '''
+        Function that waits until one of the given elements is present on the page.
+
+        :param session: RPA session object
+        :param xpaths: xpath, or list of xpaths, of the elements to wait for
+        :type: str or list
+        :param step_name: name of the navigation step, used for logging the timings
+        :type: str
+        :param timeout: maximum number of seconds to wait. Default is None, meaning self.readiness_timeout
+        :type: float
+        :return: the first xpath found on the page, or None if none of them appeared before the timeout
+        :rtype: str
+        '''
+        if isinstance(xpaths, str):
+            xpaths = [xpaths]
+
+        def first_present():
+            for xpath in xpaths:
+                if session.present(xpath):
+                    return xpath
+            return None
+
+        return self.waiting_until(step_name, first_present, timeout=timeout)
+
+    def waiting_for_absence(self, session, xpath, step_name, timeout = None):
+        '''
+        Function that waits until an element is no longer on the page, e.g. a banner closed by a click.
+
+        :param session: RPA session object
+        :param xpath: xpath of the element to wait for
+        :type: str
+        :param step_name: name of the navigation step, used for logging the timings
+        :type: str
+        :param timeout: maximum number of seconds to wait. Default is None, meaning self.readiness_timeout
+        :type: float
+        :return: True if the element disappeared, None if it was still present after the timeout
+        '''
+        return self.waiting_until(step_name, lambda: not session.present(xpath), timeout=timeout)
+
+    def waiting_for_change(self, session, xpath, previous_text, step_name, timeout = None):
+        '''
+        Function that waits until the text of an element differs from previous_text and stays the same over two polls,
+        so that a table re-rendered by a dropdown menù is read only once it has been fully rendered.
+
+        :param session: RPA session object
+        :param xpath: xpath of the element to read
+        :type: str
+        :param previous_text: text of the element read before the action that re-renders it
+        :type: str
+        :param step_name: name of the navigation step, used for logging the timings
+        :type: str
+        :param timeout: maximum number of seconds to wait. Default is None, meaning self.readiness_timeout
+        :type: float
+        :return: True once the new text is stable, None if it did not change before the timeout
+        '''
+        last_text = [previous_text]
+
+        def changed_and_stable():
+            text = session.read(xpath)
+            stable = text != previous_text and text == last_text[0]
+            last_text[0] = text
+            return stable
+
+        return self.waiting_until(step_name, changed_and_stable, timeout=timeout)
+
+    def waiting_for_expiration(self, session, expiration):
+        '''
+        Function that waits until the header of the option ruler shows the expiration date just selected in the dropdown menù.
+
+        :param session: RPA session object
+        :param expiration: expiration date selected, e.g. GIU22
+        :type: str
+        :return: True once the header shows the expiration date, None if it did not before the timeout
+        '''
+        return self.waiting_until(
+            'option ruler table {}'.format(expiration),
+            lambda: session.read('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]').split('\n')[0][-5:] == expiration
+            )
+
+    def reading_expiration_buttons(self, session):
+        '''
+        Function that opens the expiration date dropdown menù of the option ruler and reads every button listed in it.
+
+        :param session: RPA session object
+        :return: dict having the expiration date (e.g. GIU22) as key and the xpath of the corresponding button as value
+        :rtype: dict
+        '''
+        button_xpath = '/html/body/div[14]/div[1]/div[1]/table/thead/tr[1]/th/div[2]/button[{}]'
+
+        self._logging.info("Clicking the dropdown menù for expiration date")
+        session.click('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]/i')
+        self.waiting_for_element(session, button_xpath.format(1), 'expiration dropdown')
+
+        dict_buttons = {}
+        i = 1
+        while session.present(button_xpath.format(i)):
+            expiration = session.read(button_xpath.format(i))[-5:]
+            self._logging.info("Expiration date number {0} in the list is {1}".format(i, expiration))
+            dict_buttons[expiration] = button_xpath.format(i)
+            i += 1
+
+        return dict_buttons
+
+    def downloading_option_ruler(self, session, expiration):
+        '''
+        Function that reads the option ruler table currently shown on the page and stores it in a csv file, one per expiration date
+
+        :param session: RPA session object
+        :param expiration: expiration date currently selected, e.g. GIU22
+        :type: str
+        :return: name of the csv file, relative to the data folder
+        :rtype: str
+        '''
+        if self.all_expirations:
+            csv_name = 'options_table_{}.csv'.format(expiration)
+        else:
+            csv_name = 'options_table.csv'
+
+        self._logging.info("Downloading options data for expiration date {}".format(expiration))
+        # Reading the table containing the data
+        session.table('//*[@id="wlbody"]/div[1]/table', "data/{}".format(csv_name))
+        self.option_tables[expiration] = csv_name
+        self._logging.info("Options data download is completed and saved in data/{}".format(csv_name))
+
+        return csv_name
+
+    def downloading_market_prices(self, session, all_expirations = False):
 
         '''
         Function that reads data from "Tabellone" and store data in a csv file 
 
         :param session: RPA session object
+        :param all_expirations: whether to download the option ruler of every expiration date listed in the dropdown menù, instead of only expiration_date_of_interest
+        :type: bool
         '''
 
+        self.all_expirations = all_expirations
+        # Raw option ruler csv file downloaded for each expiration date
+        self.option_tables = {}
+
         session.click('#menugif')
+        self.waiting_for_element(session, '//*[@id="MenuOpt"]', 'option ruler menu')
         session.click('//*[@id="MenuOpt"]')
         self._logging.info("Going to the option ruler")
+        self.waiting_for_element(session, '//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]', 'option ruler table')
 
         current_expiration_string = session.read('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]')
         self._logging.info("String for the selected expiration date is {}".format(current_expiration_string))
         self.current_exp_date = current_expiration_string.split('\n')[0][-5:]
         self._logging.info("String for the selected expiration date is {}".format(self.current_exp_date))
 
+        if all_expirations:
+            # Walking every expiration date in the dropdown menù within the same session
+            dict_buttons = self.reading_expiration_buttons(session)
+            # Dropdown menù is closed by selecting the expiration date already shown
+            session.click(dict_buttons.get(self.current_exp_date, list(dict_buttons.values())[0]))
+            self.downloading_option_ruler(session, self.current_exp_date)
+            for key in dict_buttons:
+                if key in self.option_tables:
+                    continue
+                # Buttons are re-rendered every time the dropdown menù is opened
+                value = self.reading_expiration_buttons(session)[key]
+                self._logging.info("Selecting the button for expiration date {}".format(key))
+                session.click(value)
+                self.waiting_for_expiration(session, key)
+                self.current_exp_date = key
+                self.downloading_option_ruler(session, key)
+            return
 
         if self.current_exp_date == self.expiration_date_of_interest:
             # In case desidred expiration date is already selected, then no need to click on the dropdown menù
@@ -79,25 +285,14 @@ class DirectaDataPull:
         else:
             # In case the desired expiration date is not selected, then click on the dropdown menù to change period
             self._logging.info("Changing the period of interest")
-            self._logging.info("Clicking the dropdown menù for expiration date")
-            r.click('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]/i')
-            # First button in the dropdown menù, containing options expiration dates
-            first_button = session.read('/html/body/div[14]/div[1]/div[1]/table/thead/tr[1]/th/div[2]/button[1]')[-5:]
-            self._logging.info("First expiration date in the list is {}".format(first_button))
-            # Second button in the dropdown menù, containing options expiration dates
-            second_button = session.read('/html/body/div[14]/div[1]/div[1]/table/thead/tr[1]/th/div[2]/button[2]')[-5:]
-            self._logging.info("Second expiration date in the list is {}".format(second_button))
-
-            # Dict containing the two expiration dates available on Directa
-            dict_buttons = {first_button: '/html/body/div[14]/div[1]/div[1]/table/thead/tr[1]/th/div[2]/button[1]', 
-                    second_button: '/html/body/div[14]/div[1]/div[1]/table/thead/tr[1]/th/div[2]/button[2]'
-                    }
+            dict_buttons = self.reading_expiration_buttons(session)
 
             # Iterating over the expiration dates dict and click the button that corresponds to the desired expiration date as a parameter
             for key, value in dict_buttons.items():
                 if key == self.expiration_date_of_interest:
                     self._logging.info("Selecting the button for expiration date {}".format(key))
                     session.click(value)
+                    self.waiting_for_expiration(session, key)
     
             # reading the new expiration date so it can be stored on the MariaDB
             current_expiration_string = r.read('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/th/div[1]')
@@ -105,10 +300,7 @@ class DirectaDataPull:
             self.current_exp_date = current_expiration_string.split()[2]
             self._logging.info("Selected expiration date is {}".format(self.current_exp_date))
         
-        self._logging.info("Downloading options data")
-        # Reading the table containing the data
-        session.table('//*[@id="wlbody"]/div[1]/table', "data\options_table.csv")
-        self._logging.info("Options data download is completed")
+        self.downloading_option_ruler(session, self.current_exp_date)
 
     def downloading_open_positions(self, session):
 
@@ -118,6 +310,7 @@ class DirectaDataPull:
         :param session: RPA session object
         '''
         self._logging.info("Downloading 'tabellone'")
+        self.waiting_for_element(session, '//*[@id="tab"]', 'tabellone table')
         session.table('//*[@id="tab"]', "data/tabellone.csv")
         self._logging.info("'Tabellone' download is completed")
 
@@ -127,6 +320,7 @@ class DirectaDataPull:
         '''
         self._logging.info("Downloading 'calendario'")
         session.click('//*[@id="wlbody"]/div[1]/table/thead/tr[1]/td[5]')
+        self.waiting_for_element(session, '//*[@id="wlbody"]/div[8]/div/table', 'calendar table')
         session.table('//*[@id="wlbody"]/div[8]/div/table', "data/options_calendar.csv")
         self._logging.info("'Calendario' download is completed")
 
@@ -139,65 +333,99 @@ class DirectaDataPull:
         barchart_user = cred.get("BarChart.com").get("user")
         barchart_pwd = cred.get("BarChart.com").get("password")
 
+        cookie_button = '/html/body/div[9]/div[1]/div[1]/div/button[1]'
+        login_link = '//*[@id="bc-main-content-wrapper"]/div/div[1]/div[1]/div/div/div[2]/div[1]/a[1]'
+        login_input = '//*[@id="bc-login-form"]/div[1]/input'
+        # Link to the account page in the user menu, shown only once logged in (the search bar is on every page, logged in or not)
+        account_menu = '//*[@id="bc-main-header"]//a[contains(@href, "/my/account")]'
+        search_bar = '//*[@id="search"]'
+        options_table = '//*[@id="main-content-column"]//table'
+
         r.url('https://www.barchart.com/eu')
-        time.sleep(10)
 
         # Cookie acceptance
         session.frame()
-        if session.present('/html/body/div[9]/div[1]/div[1]/div/button[1]'):
+        if self.waiting_for_element(session, [cookie_button, login_link], 'BarChart.com home page') == cookie_button:
             self._logging.info("Cookie rejection")
-            session.click('/html/body/div[9]/div[1]/div[1]/div/button[1]')
-            time.sleep(5)
+            session.click(cookie_button)
+            self.waiting_for_absence(session, cookie_button, 'BarChart.com cookie banner closed')
         else:
             self._logging.info('Cookie already cleared')
 
         # Login
-        session.click('//*[@id="bc-main-content-wrapper"]/div/div[1]/div[1]/div/div/div[2]/div[1]/a[1]')
-        if session.present('//*[@id="bc-login-form"]/div[1]/input'):
+        session.click(login_link)
+        if self.waiting_for_element(session, [login_input, account_menu], 'BarChart.com login form') == login_input:
             self._logging.info("Logging in to BarChart.com")
-            time.sleep(2)
-            session.type('//*[@id="bc-login-form"]/div[1]/input', "[clear]")
-            session.type('//*[@id="bc-login-form"]/div[1]/input', "{}".format(barchart_user))
-            time.sleep(2)
+            session.type(login_input, "[clear]")
+            session.type(login_input, "{}".format(barchart_user))
+            self.waiting_for_element(session, '//*[@id="login-form-password"]', 'BarChart.com password field')
             session.type('//*[@id="login-form-password"]', "[clear]")
             session.type('//*[@id="login-form-password"]', "{}".format(barchart_pwd))
             session.click('//*[@id="bc-login-form"]/div[4]/button')
+            self.waiting_for_element(session, account_menu, 'BarChart.com logged in')
         else:
             self._logging.info("Already logged in to BarChart.com")
 
         # Searching for symbol page
-        time.sleep(5)
+        self.waiting_for_element(session, search_bar, 'BarChart.com search bar')
         self._logging.info("Searching for {}".format(self.symbol))
-        session.type('//*[@id="search"]', "{}[enter]".format(self.symbol))
+        session.type(search_bar, "{}[enter]".format(self.symbol))
+        self.waiting_for_element(session, '//*[@id="bc-main-content-wrapper"]/div/div[2]/div[1]/div/div[2]/div[2]/div/ul/li[5]/ul/li[2]/a', 'BarChart.com symbol page')
         session.click('//*[@id="bc-main-content-wrapper"]/div/div[2]/div[1]/div/div[2]/div[2]/div/ul/li[5]/ul/li[2]/a')
         # Month of interest
-        session.select('//*[@id="bc-options-toolbar__dropdown-month"]', self.yearmonth_eng)
-        # Stacked data
-        session.select('//*[@id="main-content-column"]/div/div[3]/div/div[3]/select', 'Stacked')
-        # All strikes
-        session.select('//*[@id="main-content-column"]/div/div[3]/div/div[2]/select', 'Show All') 
-        time.sleep(5)
+        self.waiting_for_element(session, '//*[@id="bc-options-toolbar__dropdown-month"]', 'BarChart.com options page')
+        self.waiting_for_element(session, options_table, 'BarChart.com options table')
+        # Each selection re-renders the options table, which is waited for before the next one so that the download gets the full chain
+        # (the toolbar and its download link are on the page before any selection)
+        selections = [
+            ('//*[@id="bc-options-toolbar__dropdown-month"]', self.yearmonth_eng),
+            # Stacked data
+            ('//*[@id="main-content-column"]/div/div[3]/div/div[3]/select', 'Stacked'),
+            # All strikes
+            ('//*[@id="main-content-column"]/div/div[3]/div/div[2]/select', 'Show All'),
+            ]
+        for select_xpath, option in selections:
+            previous_table = session.read(options_table)
+            session.select(select_xpath, option)
+            self.waiting_for_change(session, options_table, previous_table, "BarChart.com options table '{}'".format(option))
         self._logging.info("Downloading 'greeks'")
+        # Browser downloads go to a dedicated folder, so that the greeks file is the only new file in it
+        session.download_location(self.download_capture.download_dir)
+        self.download_capture.watching()
         session.click('//*[@id="main-content-column"]/div/div[3]/div/div[4]/a')
-        time.sleep(5)
-        self._logging.info("'Greeks' download is completed")
-        try:
-            self.newest_file = max(glob.iglob('/home/edoardo-sezzi/Desktop/trading/*.csv'), key=os.path.getctime).split('/')[-1]   
-            self._logging.info("Newest file is {}".format(self.newest_file))   
-            os.rename("/home/edoardo-sezzi/Desktop/trading/{}".format(self.newest_file), "data/greeks/{}".format(self.newest_file))
-            self._logging.info("csv file has been moved to data folder")
-        except ValueError:
-            self._logging.warning("File is not placed in the directory, checking what's the latest file in data/greeks directory")
-            self.newest_file = max(glob.iglob('/home/edoardo-sezzi/Desktop/trading/data/greeks/*.csv'), key=os.path.getctime).split('/')[-1]    
-
-    def navigating_directa(self, options_prices = True, options_calendar = True, options_open_positions = True, options_greeks = True):
+        downloaded_file = self.waiting_until('BarChart.com greeks download', self.download_capture.finding_new_file)
+        self.newest_file, self.greeks_hash, self.greeks_already_ingested = None, None, False
+
+        if downloaded_file is None:
+            self._logging.warning("No greeks file has been downloaded, greeks data will not be loaded")
+            return
+
+        self.newest_file = os.path.basename(downloaded_file)
+        self._logging.info("'Greeks' download is completed, file is {}".format(self.newest_file))
+        os.replace(downloaded_file, "data/greeks/{}".format(self.newest_file))
+        self._logging.info("csv file has been moved to data folder")
+        # Same footer line skipped by cleaning_greeks_data, so that identical greeks downloaded at different times have the same hash
+        self.greeks_hash = self.download_capture.hashing_file("data/greeks/{}".format(self.newest_file), footer_lines=1)
+        self.greeks_already_ingested = self.download_capture.is_ingested(self.greeks_hash)
+        if self.greeks_already_ingested:
+            self._logging.info("Greeks file {} has the same content as a file already ingested, skipping it".format(self.newest_file))
+
+    def registering_greeks_file(self):
         '''
-        Function that navigate the directa website and download the data through Option Ruler. 
-        It allows to navigate the data based on desired expiration date
-        
-        :param expiration_date_of_interest: expiration date of interest, in form of MMMYY, e.g. GIU22 - remember to use the correct abbreviation for the month, in italian
-        :type: str
-        :return None       
+        Function that marks the greeks file downloaded in this session as ingested, so that the same content is skipped by the next runs.
+        To be called once greeks data has been loaded on the DB.
+
+        :return None
+        '''
+        if self.greeks_hash is not None:
+            self.download_capture.registering(self.greeks_hash, self.newest_file)
+            self._logging.info("Greeks file {} registered as ingested".format(self.newest_file))
+
+    def logging_in_directa(self):
+        '''
+        Function that opens the web session, logs in to Directa and selects the frame of the personal page.
+
+        :return None
         '''
 
         # NAMESPACE = "directa"
@@ -216,21 +444,37 @@ class DirectaDataPull:
         r.type('//*[@id="PASSW"]', "{}[enter]".format(directa_pwd))
         r.click('/html/body/div[1]/div[2]/div[1]/form/div[5]/div[1]/div[3]/button')
         self._logging.info("Login successful")
-        time.sleep(15)
+        self.waiting_for_element(r, '//*[@id="dliteframe"]', 'Directa personal page')
         self._logging.info("Selecting the frame so it is possible to navigate the personal page")
         r.frame("dliteframe")
-        if r.present('//*[@id="bottoneavanti"]'):
+        if self.waiting_for_element(r, ['//*[@id="bottoneavanti"]', '//*[@id="menugif"]'], 'Directa frame content') == '//*[@id="bottoneavanti"]':
             r.click('//*[@id="bottoneavanti"]')
         else:
             self._logging.info("No screen page with 'bottone avanti'")
 
+    def navigating_directa(self, options_prices = True, options_calendar = True, options_open_positions = True, options_greeks = True, all_expirations = False):
+        '''
+        Function that navigate the directa website and download the data through Option Ruler. 
+        It allows to navigate the data based on desired expiration date
+        
+        :param expiration_date_of_interest: expiration date of interest, in form of MMMYY, e.g. GIU22 - remember to use the correct abbreviation for the month, in italian
+        :type: str
+        :param all_expirations: whether to download the option ruler of every expiration date listed on Directa within the same session. Default is False
+        :type: bool
+        :return None       
+        '''
+        # Greeks are downloaded from BarChart.com within the same web session: TagUI init() runs end_processes, which kills any other
+        # TagUI/Chrome session of the host, so the BarChart.com download cannot run in parallel with the Directa one
+
+        self.logging_in_directa()
+
         # Downloading "Tabellone" data
         if options_open_positions:
             self.downloading_open_positions(r)
 
         # Downloading "Option Ruler" data
         if options_prices:
-            self.downloading_market_prices(r)
+            self.downloading_market_prices(r, all_expirations=all_expirations)
 
         # Downloading "Calendario" data
         if options_calendar:
@@ -242,120 +486,196 @@ class DirectaDataPull:
 
         r.close()
         self._logging.info("Closing the web session")
+        self._logging.info("Seconds spent waiting per step: {}".format(
+            ', '.join('{0}={1:.2f}'.format(k, v) for k, v in self.step_timings.items())
+            ))
 
-    def cleaning_options_data(self, csv_for_date = 'options_table.csv'):
+    def cleaning_options_data(self, csv_for_date = 'options_table.csv', expiration_date = None, data_folder = 'data', snapshot_date = None, save_files = True):
         '''
         Function that load a csv file downloaded from Directa website and clean it. It adds few variables to allow a smooth loading on a RDBMS DB.
         
         :param csv_for_date: name of csv file downloaded from Directa website. Default is 'options_table.csv'. the function extract the creation time of the file so it will use that for the composition of pk
         :type: str
+        :param expiration_date: expiration date of the option ruler stored in the csv file. Default is None, meaning the expiration date selected during the scraping
+        :type: str
+        :param data_folder: folder containing the csv file. Default is 'data'
+        :type: str
+        :param snapshot_date: date of the snapshot, format should be 'yyyy-mm-dd'. Default is None, meaning the creation time of the csv file
+        :type: str
+        :param save_files: whether to save the cleaned data in data_folder, in the formats declared for this run. Default is True
+        :type: bool
         :return df: dataframe containing the cleaned data that can be loaded onto the DB
         :rtype: pandas.DataFrame       
         '''
 
-        # read csv file options_table.csv and extract the data
-        cols = ['call_delta', 'call_volume', 'call_bid', 'call_median_price', 'call_ask', 'call_open_interest', 'call_price', 'strike',
-                'put_price', 'put_volume', 'put_bid', 'put_median_price', 'put_ask', 'put_open_interest', 'put_delta']
- 
-        self._logging.info("Reading csv file for options data")     
-        df = pd.read_csv(
-            "data/options_table.csv", skiprows=5, names=cols, 
-            thousands='.', decimal=',', usecols = np.arange(1, 16), na_values=['·', 'close']
-            )
-        df_call, df_put = df.iloc[: , :8], df.iloc[: , 7:]
-        df_call.loc[:, 'option_type'] = 'C'
-        df_put.loc[:, 'option_type'] = 'P'
-        call_cols = [s.replace('call_', '') for s in df_call.columns]
-        put_cols = [s.replace('put_', '') for s in df_put.columns] 
-        df_call.columns, df_put.columns = call_cols, put_cols
-        self._logging.info("Formatting DataFrame from wide to long")   
-        df_long = pd.concat([df_call, df_put], ignore_index=False)
-        self.insert_date = datetime.fromtimestamp(os.path.getctime('data/{0}'.format(csv_for_date))).strftime('%Y-%m-%d')
+        expiration_date = self.current_exp_date if expiration_date is None else expiration_date
+        csv_path = os.path.join(data_folder, csv_for_date)
+        csv_clean_name = csv_for_date.replace('.csv', '_clean')
+
+        self._logging.info("Reading csv file for options data")
+        # Prices are kept as float64 so that values loaded on the DB are not affected by float32 rounding
+        columns, future = parse_option_ruler(csv_path, float_dtype=np.float64)
+        self._logging.info("Formatting DataFrame from wide to long")
+        df_long = pd.DataFrame(columns)
+        if snapshot_date is None:
+            self.insert_date = datetime.fromtimestamp(os.path.getctime(csv_path)).strftime('%Y-%m-%d')
+        else:
+            self.insert_date = snapshot_date
         df_long['insert_date'] = self.insert_date
         df_long['update_time'] = datetime.now()
-        df_long['expiration_date'] = self.current_exp_date
+        df_long['expiration_date'] = expiration_date
         sql_pk = ["strike", "insert_date", "expiration_date", "option_type"]
         # df_long['pk'] = df_long.loc[:, ['strike', 'insert_date', 'expiration_date', 'option_type']].astype(str).agg('-'.join, axis = 1)
-        future = pd.read_csv('data/options_table.csv', skiprows=0, nrows=1, usecols = [3], thousands='.', decimal=',').columns[0]
-        self.future = float(future[:future.rfind('\n')].replace('.','').replace(',','.'))
-        df_long.to_excel("data/options_table_clean.xlsx", index=False)
-        df_long.to_csv("data/options_table_clean.csv", index=False)
-        self._logging.info("Data cleaning for options data is completed and csv/xlsx files have been generated and saved")
+        self.future = future
+        # Future value is stored per expiration date so that the strategy calculator uses the right one
+        self.futures[expiration_date] = self.future
+        if save_files:
+            self.export_worker.exporting(df_long, os.path.join(data_folder, csv_clean_name))
+        self._logging.info("Data cleaning for options data is completed and csv/xlsx files have been queued for saving")
 
         return df_long, sql_pk
 
-    def cleaning_tabellone_data(self, purchase_date = None):
+    def cleaning_all_options_data(self):
+        '''
+        Function that cleans the option ruler csv file of every expiration date downloaded during the session and stacks them,
+        so that all the expiration dates can be upserted in one pass.
+
+        :return df: dataframe containing the cleaned data of all the expiration dates that can be loaded onto the DB
+        :rtype: pandas.DataFrame
+        '''
+        list_df = []
+        for expiration, csv_name in self.option_tables.items():
+            self._logging.info("Cleaning options data for expiration date {}".format(expiration))
+            df_long, sql_pk = self.cleaning_options_data(csv_name, expiration_date=expiration)
+            list_df.append(df_long)
+
+        return pd.concat(list_df, ignore_index=True), sql_pk
+
+    def cleaning_tabellone_data(self, purchase_date = None, csv_path = 'data/tabellone.csv'):
         '''
         :param purchase_date: date of purchase of the option. Default is None. format should be 'yyyy-mm-dd'
         :type: str
+        :param csv_path: path of the 'tabellone' csv file downloaded from Directa website. Default is 'data/tabellone.csv'
+        :type: str
         '''
 
-        locale.setlocale(locale.LC_NUMERIC, '')
-
         self._logging.info("Adding information to 'tabellone")
         cols_traded = ['symbol', 'description', 'current_price', 'benchmark', 'trend_perc', 'qty', 'price',
                         'gain_loss_abs', 'gain_loss_perc', 'recovery']
         df = pd.read_csv(
-            "data/tabellone.csv", doublequote=False, skiprows = 1, names=cols_traded, 
+            csv_path, doublequote=False, skiprows = 1, names=cols_traded, 
             thousands='.', decimal=',', usecols = np.arange(0, 10), na_values=['·', 'close']
             ).iloc[:-1, :]
         cols_to_check = ['trend_perc', 'price', 'gain_loss_abs', 'gain_loss_perc', 'recovery']
-        df[cols_to_check] = df[cols_to_check].replace({'\+': '', '%': '', '€': ''}, regex=True)
         df['purchase_date'] = pd.to_datetime(purchase_date, format='%Y-%m-%d')
-        df['underlying_asset'] = df['description'].str.split('[" ".]').str[1]
-        df['expiration_date'] = pd.to_datetime(df['description'].str.split().str[3].str[:2] + '-' + df['description'].str.split().str[3].str[2:] , format='%y-%m')
-        df['option_type'] = df['description'].str.split().str[1]
-        df['strike'] = df['description'].str.split().str[2]
+        # Extracting underlying asset, expiration date, option type and strike from the description in one pass
+        df_description = parse_tabellone_description(df['description'])
+        for col in df_description.columns:
+            df[col] = df_description[col]
         df['update_time'] = datetime.now()
         sql_pk = ["strike", "purchase_date", "expiration_date", "option_type", "underlying_asset"]
         # df['pk'] = df.loc[:, ['description', 'purchase_date']].astype(str).agg('-'.join, axis = 1)
-        # Changing decimals from comma to dot and viceversa for thousands
-        df[cols_to_check] = df[cols_to_check].applymap(atof)
+        # Changing decimals from comma to dot and viceversa for thousands, symbols are removed as well
+        df[cols_to_check] = parse_italian_numbers(df[cols_to_check])
         # dividing percentage columns by 100
         for col in df.columns[df.columns.str.contains('perc')]:
             df[col] = df[col]/100
     
         return df, sql_pk
 
-    def cleaning_greeks_data(self):
+    def cleaning_greeks_data(self, csv_path = None, snapshot_date = None, expiration_date = None):
         '''
         Function that imports csv file located in data/greeks folder, remove the column "Symbol" and store a pandas DataFrame ready to be load on DB.
+
+        :param csv_path: path of the csv file downloaded from BarChart.com. Default is None, meaning the file downloaded during the scraping
+        :type: str
+        :param snapshot_date: date of the snapshot, format should be 'yyyy-mm-dd'. It replaces intraday timestamps in the file. Default is None, meaning today
+        :type: str
+        :param expiration_date: expiration date the file has been downloaded for, e.g. 'SET22'. Default is None, meaning the expiration date of interest
+        :type: str
+        :return df: dataframe containing the cleaned data, None when no new greeks file has been downloaded or its content has already been ingested
+        :rtype: pandas.DataFrame
         '''
+
+        sql_pk = ["strike", "option_type", "expiration_date", "insert_date"]
+
+        if csv_path is None:
+            if self.newest_file is None or self.greeks_already_ingested:
+                self._logging.info("No new greeks data to clean")
+                return None, sql_pk
+            csv_path = "data/greeks/{}".format(self.newest_file)
+        snapshot_date = date.today() if snapshot_date is None else datetime.strptime(snapshot_date, '%Y-%m-%d')
             
         self._logging.info("Reading csv file for greeks data")     
         headers = [
             'strike', 'option_type', 'last','IV','delta',
             'gamma','theta','vega','IV_skew', 'insert_date'
             ]
-        df = pd.read_csv("data/greeks/{}".format(self.newest_file), skipfooter=1, engine='python', header = 0, names = headers)
+        df = pd.read_csv(csv_path, skipfooter=1, engine='python', header = 0, names = headers)
         df.loc[df['option_type'] == 'Call', 'option_type'] = 'C'
         df.loc[df['option_type'] == 'Put', 'option_type'] = 'P'
-        df.loc[df['insert_date'].str.contains("CT"), 'insert_date'] = date.today().strftime('%m/%d/%y')
+        df.loc[df['insert_date'].str.contains("CT"), 'insert_date'] = snapshot_date.strftime('%m/%d/%y')
         df['insert_date'] = pd.to_datetime(df['insert_date'], format='%m/%d/%y')
         cols_to_check = ['IV', 'IV_skew']
         df[cols_to_check] = df[cols_to_check].replace({'\+': '', '%': '', '€': ''}, regex=True).astype(float)
-        df['expiration_date'] = self.yearmonth_dt
+        df['expiration_date'] = self.yearmonth_dt if expiration_date is None else parse_expiration_codes(pd.Series([expiration_date])).iloc[0]
         df['update_time'] = datetime.now()
-        sql_pk = ["strike", "option_type", "expiration_date", "insert_date"]
+        df['source'] = 'barchart'
         self._logging.info("Data cleaning for greeks data is completed and ready to be loaded on DB")
 
         return df, sql_pk
 
 
-    def cleaning_calendar_data(self):
+    def computing_greeks(self, df_options, expiration_date = None):
+        '''
+        Function that computes the greeks of an option ruler locally, solving implied volatilities from its median prices and pricing
+        the chain with Black-76, so that greeks are available without downloading them from BarChart.com.
+        Conventions differ from the BarChart.com file (last is the median price, IV is implied from mid prices), so rows are marked with source 'black76'.
+
+        :param df_options: cleaned option ruler, as returned by cleaning_options_data or cleaning_all_options_data
+        :type: pandas.DataFrame
+        :param expiration_date: expiration date whose greeks are computed. Default is None, meaning the expiration date of interest
+        :type: str
+        :return df: dataframe in the format of greeks_options, ready to be loaded on DB. None when the option ruler of the expiration date has not been cleaned
+        :rtype: pandas.DataFrame
+        '''
+        expiration_date = self.expiration_date_of_interest if expiration_date is None else expiration_date
+        sql_pk = ["strike", "option_type", "expiration_date", "insert_date"]
+
+        df_expiration = df_options[df_options['expiration_date'] == expiration_date]
+        if df_expiration.empty:
+            self._logging.warning("No option ruler cleaned for expiration date {}, greeks cannot be computed locally and will not be loaded".format(expiration_date))
+            return None, sql_pk
+
+        future = self.futures.get(expiration_date, self.future)
+        sigma, iv_stats = self.iv_solver.solving_chain(df_expiration, future)
+        self.step_timings['solving_implied_vol'] = iv_stats['seconds']
+        df = chain_greeks(df_expiration, future, sigma)
+        # Strikes without a price or an implied volatility have no greeks
+        df = df[np.isfinite(df['IV'])].reset_index(drop=True)
+        df['source'] = 'black76'
+        self._logging.warning("Greeks of {0} computed locally with Black-76 instead of BarChart.com: {1} strikes, {2} not converged".format(
+            expiration_date, len(df), iv_stats['n_not_converged']
+            ))
+
+        return df, sql_pk
+
+    def cleaning_calendar_data(self, csv_path = 'data/options_calendar.csv', snapshot_date = None, save_files = True):
         '''
         Function that load a csv file downloaded from Directa website and clean it. It adds few variables to allow a smooth loading on a RDBMS DB.
         
-        :param csv_for_date: name of csv file downloaded from Directa website. Default is 'options_table.csv'. the function extract the creation time of the file so it will use that for the composition of pk
+        :param csv_path: path of the calendar csv file downloaded from Directa website. Default is 'data/options_calendar.csv'
         :type: str
-        :param purchase_date: date of purchase of the option. Default is None. format should be 'yyyy-mm-dd'
+        :param snapshot_date: date of the snapshot, format should be 'yyyy-mm-dd'. Default is None, meaning today
         :type: str
+        :param save_files: whether to save the cleaned data in the formats declared for this run. Default is True
+        :type: bool
         :return df: dataframe containing the cleaned data that can be loaded onto the DB
         :rtype: pandas.DataFrame       
         '''
 
         self._logging.info("Importing calendar data file and cleaning it") 
-        df = pd.read_csv('data/options_calendar.csv', skiprows=1, na_values=['·', 'close'], thousands='.', decimal=',')
+        df = pd.read_csv(csv_path, skiprows=1, na_values=['·', 'close'], thousands='.', decimal=',')
         df.columns = df.columns.str.lower()
         self._logging.info("Melting from wide to long")
         df_long = df.melt(id_vars='strike', var_name = 'expiration_date', value_name = 'price')
@@ -364,23 +684,35 @@ class DirectaDataPull:
         df_long.loc[:, 'expiration_date'] = pd.to_datetime(df_long.loc[:, 'expiration_date'], format='%d-%m-%Y')
         sql_pk = ["strike" , "expiration_date", "option_type"]
         # df_long['pk'] = df_long.loc[:, ['strike', 'expiration_date', 'option_type']].astype(str).agg('-'.join, axis = 1)
-        df_long['insert_date'] = date.today().strftime('%Y-%m-%d')
-        df_long.to_csv('data/options_calendar_clean.csv', index=False)
-        self._logging.info("Data cleaning for calendar data is completed and csv/xlsx files have been generated and saved")
+        df_long['insert_date'] = date.today().strftime('%Y-%m-%d') if snapshot_date is None else snapshot_date
+        if save_files:
+            self.export_worker.exporting(df_long, 'data/options_calendar_clean')
+        self._logging.info("Data cleaning for calendar data is completed and csv/xlsx files have been queued for saving")
 
         return df_long, sql_pk
 
 
-    def editing_strategy_calculator(self, input_df, grid_shift_input = 25):
+    def editing_strategy_calculator(self, input_df, grid_shift_input = 25, in_background = True):
         '''
         Function that iterates through row of spreadsheet and, depending on the type of option,
         populate the ceels with options prices.
 
         :param df: pandas DataFrame containing the data to be populated in strategy calculator (put/call options prices)
         :type: pandas.DataFrame
+        :param in_background: whether to queue the editing to the export worker instead of waiting for openpyxl to load and save the workbook. Default is True
+        :type: bool
         :return: None
         '''
 
+        if input_df.empty:
+            raise ValueError('No option prices to write into the strategy calculator | Filter input_df on an expiration date that has been cleaned')
+
+        if in_background:
+            self.export_worker.submitting(
+                'strategy calculator', self.editing_strategy_calculator, input_df.copy(), grid_shift_input=grid_shift_input, in_background=False
+                )
+            return
+
         self._logging.info("Editing strategy calculator")
 
         # Editing strategy calculator
@@ -397,9 +729,13 @@ class DirectaDataPull:
         workbook_strategy_calculator = load_workbook('strategy_calculator/STRATEGY.xlsx')
         worksheet = workbook_strategy_calculator['EUROSTOXX50']
 
+        # Using the future of the expiration date the prices refer to
+        expiration = input_df['expiration_date'].iloc[0]
+        future = self.futures.get(expiration, self.future)
+
         # Insert current future value
-        worksheet['D5'] = self.future
-        worksheet['D28'] = round_nearest_base(self.future, base = grid_shift)
+        worksheet['D5'] = future
+        worksheet['D28'] = round_nearest_base(future, base = grid_shift)
         worksheet['F2'] = grid_shift
         worksheet['E49'] = option_fee
 
@@ -408,10 +744,10 @@ class DirectaDataPull:
 
         self._logging.info("Strikes in analysis are {}".format(clean_df['strike'].unique()))
 
-        self._logging.info('Rounded future is {}'.format(round_nearest_base(self.future, base = grid_shift)))
+        self._logging.info('Rounded future is {}'.format(round_nearest_base(future, base = grid_shift)))
 
-        min_index = int(clean_df.median_price[clean_df.strike == round_nearest_base(self.future, base = grid_shift)].index[0] - (last_row_excel-first_row_excel)/2)
-        max_index = int(clean_df.median_price[clean_df.strike == round_nearest_base(self.future, base = grid_shift)].index[0] + (last_row_excel-first_row_excel)/2) 
+        min_index = int(clean_df.median_price[clean_df.strike == round_nearest_base(future, base = grid_shift)].index[0] - (last_row_excel-first_row_excel)/2)
+        max_index = int(clean_df.median_price[clean_df.strike == round_nearest_base(future, base = grid_shift)].index[0] + (last_row_excel-first_row_excel)/2) 
 
         self._logging.info('Minimum index is {}'.format(min_index))
         self._logging.info('Maximum index is {}'.format(max_index))
@@ -429,9 +765,9 @@ class DirectaDataPull:
                     worksheet[get_column_letter(cell.column) + str(cell.row)] = prices[i]
 
         self._logging.info("Saving the strategy calculator xlsx file")
-        workbook_strategy_calculator.save("strategy_calculator/Strategy_{0}_{1}.xlsx".format(self.insert_date, self.current_exp_date))
+        workbook_strategy_calculator.save("strategy_calculator/Strategy_{0}_{1}.xlsx".format(self.insert_date, expiration))
 
-        self._logging.info("Editing strategy calculator is completed and file strategy_calculator/Strategy_{0}_{1}.xlsx has been saved".format(self.insert_date, self.current_exp_date))
+        self._logging.info("Editing strategy calculator is completed and file strategy_calculator/Strategy_{0}_{1}.xlsx has been saved".format(self.insert_date, expiration))
 
 
 
@@ -0,0 +1,111 @@
+import os, json, hashlib
+from utils.utils import mkdir_p
+
+
+class DownloadCapture:
+
+    '''
+    ## Capture files downloaded by the browser in a dedicated folder and keep track of the ones already ingested through their content hash
+    '''
+
+    # Extensions used by browsers for downloads still in progress
+    PARTIAL_EXTENSIONS = ('.crdownload', '.part', '.tmp')
+
+    def __init__(self, download_dir = 'data/downloads', registry_path = 'data/greeks/ingested_files.json'):
+        '''
+        Constructor method
+        '''
+        self.download_dir = os.path.abspath(download_dir)
+        self.registry_path = registry_path
+        mkdir_p(os.path.join(self.download_dir, ''))
+        self.known_files = set()
+        self._sizes = {}
+
+    def watching(self):
+        '''
+        Function that records the files already present in the download folder, so that only files appearing afterwards are captured.
+        To be called right before triggering the download.
+
+        :return: None
+        '''
+        self.known_files = set(os.listdir(self.download_dir))
+        self._sizes = {}
+
+    def finding_new_file(self):
+        '''
+        Function that checks whether a new download is completed. A file is considered completed when it is not a partial download
+        and its size did not change since the previous check. Meant to be polled until it returns a path.
+
+        :return: path of the downloaded file, or None if the download is not completed yet
+        :rtype: str
+        '''
+        for file_name in sorted(set(os.listdir(self.download_dir)) - self.known_files):
+            if file_name.endswith(self.PARTIAL_EXTENSIONS):
+                continue
+            file_path = os.path.join(self.download_dir, file_name)
+            size = os.path.getsize(file_path)
+            if size > 0 and self._sizes.get(file_name) == size:
+                return file_path
+            self._sizes[file_name] = size
+
+        return None
+
+    @staticmethod
+    def hashing_file(file_path, footer_lines = 0):
+        '''
+        Function that computes the SHA-256 hash of the file content, footer lines excluded.
+        BarChart.com files end with a timestamped footer line, which would give a different hash to every download of the same greeks.
+
+        :param file_path: path of the file
+        :type: str
+        :param footer_lines: number of lines at the end of the file left out of the hash, trailing empty lines excluded. Default is 0
+        :type: int
+        :return: hexadecimal digest
+        :rtype: str
+        '''
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        if footer_lines > 0:
+            lines = content.rstrip(b'\r\n').rsplit(b'\n', footer_lines)
+            content = lines[0] if len(lines) > footer_lines else b''
+
+        return hashlib.sha256(content).hexdigest()
+
+    def loading_registry(self):
+        '''
+        Function that loads the registry of files already ingested.
+
+        :return: dict having the content hash as key and the file name as value
+        :rtype: dict
+        '''
+        if not os.path.isfile(self.registry_path):
+            return {}
+        with open(self.registry_path, 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+
+    def is_ingested(self, digest):
+        '''
+        Function that checks whether a file with the same content has already been ingested.
+
+        :param digest: content hash returned by hashing_file
+        :type: str
+        :return: True if the content has already been ingested
+        :rtype: bool
+        '''
+        return digest in self.loading_registry()
+
+    def registering(self, digest, file_name):
+        '''
+        Function that marks the content hash as ingested. To be called once the data has been loaded on the DB.
+
+        :param digest: content hash returned by hashing_file
+        :type: str
+        :param file_name: name of the file, stored for reference
+        :type: str
+        :return: None
+        '''
+        registry = self.loading_registry()
+        registry[digest] = file_name
+        mkdir_p(self.registry_path)
+        with open(self.registry_path, 'w', encoding='utf-8') as fp:
+            json.dump(registry, fp, ensure_ascii=False, indent=4)
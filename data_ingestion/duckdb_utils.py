@@ -0,0 +1,364 @@
+import sys, threading
+import duckdb
+import pandas as pd
+from sqlalchemy import Integer, Float, DateTime, String
+from utils.utils import MyLogger, mkdir_p
+from data_ingestion.storage import StorageBackend
+from data_ingestion.schema import TABLES, SNAPSHOT_COLUMNS
+
+
+# DuckDB connections shared by every DuckDBUtils object of the process, keyed by database path.
+# A database file can be opened for writing by one process at a time, threads work on their own cursor of the shared connection
+_CONNECTIONS = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+# Serialises ApplySchema across the threads of upsert_tables, which share latest_snapshots
+_SCHEMA_LOCK = threading.Lock()
+
+
+def get_connection(database_path):
+    '''
+    Function that returns the DuckDB connection of the database file, opening it at the first call.
+
+    :param database_path: path of the DuckDB database file
+    :type: str
+    :return: connection
+    :rtype: duckdb.DuckDBPyConnection
+    '''
+    with _CONNECTIONS_LOCK:
+        if database_path not in _CONNECTIONS:
+            mkdir_p(database_path)
+            _CONNECTIONS[database_path] = duckdb.connect(database_path)
+
+        return _CONNECTIONS[database_path]
+
+
+def duckdb_type(sa_type):
+    '''
+    Function that translates a sqlalchemy data type into the DuckDB one, e.g. Float(precision=53) -> DOUBLE.
+
+    :param sa_type: sqlalchemy data type
+    :type: sqlalchemy.types.TypeEngine
+    :return: DuckDB data type
+    :rtype: str
+    '''
+    if isinstance(sa_type, Integer):
+        return 'INTEGER'
+    if isinstance(sa_type, Float):
+        return 'DOUBLE'
+    if isinstance(sa_type, DateTime):
+        return 'TIMESTAMP'
+    if isinstance(sa_type, String):
+        return 'VARCHAR'
+
+    return str(sa_type.compile())
+
+
+class DuckDBUtils(StorageBackend):
+
+    '''
+    ## Embedded DuckDB storage backend, to run the ingestion, the benchmarks and the analytics locally without a MariaDB server.
+    Each schema is stored in its own database file, with the same table names used on MariaDB:
+
+        data/duckdb/directa.duckdb -> directa.daily_options, directa.greeks_options, ...
+    '''
+
+    # Row hashes are kept apart from the MariaDB ones, so that each backend skips only what it has actually stored
+    ROW_HASHES_FOLDER = 'data/row_hashes/duckdb'
+
+    def __init__(self, table_schema, pandas_df, save_log = True, database_path = None):
+        '''
+        Constructor method
+
+        :param database_path: path of the DuckDB database file. Default is None, meaning data/duckdb/<table_schema>.duckdb
+        :type: str
+        '''
+        self.table_schema = table_schema
+        self.database_path = database_path if database_path is not None else 'data/duckdb/{}.duckdb'.format(table_schema)
+        # Each object gets its own cursor, so that tables can be upserted from several threads
+        self.con = get_connection(self.database_path).cursor()
+        # The database file is named after the schema, so names are qualified with the catalog to tell the two apart
+        self.catalog = self.con.execute('SELECT current_database()').fetchone()[0]
+        self.con.execute('CREATE SCHEMA IF NOT EXISTS "{0}"."{1}"'.format(self.catalog, table_schema))
+
+        self.pandas_df = pandas_df
+        # Row hashes of the rows being upserted, saved once the upsert succeeds (see DropUnchangedRows)
+        self._pending_row_hashes = None
+        self.rows_skipped = 0
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/duckdb_utils.log', name='duckdb_utils')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='duckdb_utils')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def _table(self, table_name):
+        '''
+        Qualified name of the table, catalog included.
+        '''
+        return '"{0}"."{1}"."{2}"'.format(self.catalog, self.table_schema, table_name)
+
+    def has_table(self, table_name):
+        '''
+        Function that checks whether the table exists in the schema.
+
+        :param table_name: table name
+        :type: str
+        :return: True if the table exists
+        :rtype: bool
+        '''
+        return self.con.execute(
+            'SELECT count(*) FROM information_schema.tables WHERE table_catalog = ? AND table_schema = ? AND table_name = ?', [self.catalog, self.table_schema, table_name]
+            ).fetchone()[0] > 0
+
+    def ApplySchema(self, table_name):
+        '''
+        Function that creates the table as declared in data_ingestion.schema, or adds the declared columns missing from the existing one.
+        Secondary indexes and partitions are not applied: DuckDB prunes scans with the min/max statistics of its row groups,
+        and ON CONFLICT DO UPDATE cannot assign columns covered by an index.
+
+        :param table_name: table name, one of data_ingestion.schema.TABLES
+        :type: str
+        :return: None
+        '''
+        with _SCHEMA_LOCK:
+            self._applying_schema(table_name)
+
+    def _applying_schema(self, table_name):
+        '''
+        Function that runs ApplySchema, holding the schema lock.
+        '''
+        table = TABLES[table_name]
+
+        if not self.has_table(table_name):
+            columns = ['"{0}" {1}{2}'.format(column.name, duckdb_type(column.type), '' if column.nullable else ' NOT NULL') for column in table.columns]
+            columns.append('PRIMARY KEY ({})'.format(', '.join('"{}"'.format(column.name) for column in table.primary_key.columns)))
+            self.con.execute('CREATE TABLE {0} ({1})'.format(self._table(table_name), ', '.join(columns)))
+            self._logging.info("Table {0} created in schema {1} as declared".format(table_name, self.table_schema))
+            self.InvalidateRowHashes(table_name)
+            return
+
+        existing_columns = {row[0] for row in self.con.execute(
+            'SELECT column_name FROM information_schema.columns WHERE table_catalog = ? AND table_schema = ? AND table_name = ?', [self.catalog, self.table_schema, table_name]
+            ).fetchall()}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                self.con.execute('ALTER TABLE {0} ADD COLUMN "{1}" {2}'.format(self._table(table_name), column.name, duckdb_type(column.type)))
+                self._logging.info("Column {0} added to table {1}".format(column.name, table_name))
+                self.InvalidateRowHashes(table_name)
+
+    def LoadTable(self, table_name, pk, data_types = None):
+        '''
+        Function that creates the table with its primary key from the columns of the DataFrame, if it does not exist yet.
+        Column types are the ones DuckDB infers from the DataFrame, except for the ones forced in data_types.
+        Tables declared in data_ingestion.schema are created or migrated with ApplySchema instead.
+
+        :param table_name: table name
+        :type: str
+        :param pk: primary key of the table
+        :type: list
+        :param data_types: sqlalchemy data types forced on some columns (e.g. {'strike': Integer()}), see db_utils.TABLES_DATA_TYPES
+        :type: dict
+        :return: None
+        '''
+        if table_name in TABLES:
+            self.ApplySchema(table_name)
+            if table_name in SNAPSHOT_COLUMNS:
+                self.ApplySchema('latest_snapshots')
+            return
+
+        if self.has_table(table_name):
+            self._logging.info("Table {0} already exists in schema {1}".format(table_name, self.table_schema))
+            return
+
+        data_types = data_types or {}
+        self.con.register('df_to_load', self.pandas_df)
+        try:
+            inferred_types = self.con.execute('DESCRIBE SELECT * FROM df_to_load').fetchall()
+        finally:
+            self.con.unregister('df_to_load')
+
+        columns = []
+        for column_name, column_type, *_ in inferred_types:
+            if column_name in data_types:
+                column_type = duckdb_type(data_types[column_name])
+            columns.append('"{0}" {1}'.format(column_name, column_type))
+        columns.append('PRIMARY KEY ({})'.format(', '.join('"{}"'.format(col) for col in pk)))
+
+        self.con.execute('CREATE TABLE {0} ({1})'.format(self._table(table_name), ', '.join(columns)))
+        self._logging.info("Table {0} created in schema {1} with Primary Key {2}".format(table_name, self.table_schema, pk))
+        self.InvalidateRowHashes(table_name)
+
+    def TableFingerprint(self, table_name):
+        '''
+        Function that returns the number of rows and the XOR of the row hashes of the table, computed by DuckDB.
+
+        :param table_name: table name
+        :type: str
+        :return: checksum, None if the table does not exist
+        :rtype: str
+        '''
+        if not self.has_table(table_name):
+            return None
+        n_rows, checksum = self.con.execute('SELECT count(*), bit_xor(hash(t)) FROM {0} t'.format(self._table(table_name))).fetchone()
+
+        return '{0}-{1}'.format(n_rows, checksum)
+
+    def UpdateInsertTable(self, table_name, batch_size = None):
+        '''
+        Function that performs Upserts on the table with INSERT ... ON CONFLICT DO UPDATE. The DataFrame is scanned in place by DuckDB,
+        so batch_size is not used and kept only for compatibility with the other backends.
+        Rows are first copied into a temporary staging table with the column types of the table, then merged with a single statement.
+        Rows updated are the ones whose primary key is already in the table, counted before the merge within the same transaction.
+        latest_snapshots is refreshed within the same transaction.
+
+        :param table_name: table name
+        :type: str
+        :return: number of rows inserted and updated
+        :rtype: dict
+        '''
+        pk = [row[0] for row in self.con.execute(
+            'SELECT unnest(constraint_column_names) FROM duckdb_constraints() WHERE database_name = ? AND schema_name = ? AND table_name = ? AND constraint_type = ?',
+            [self.catalog, self.table_schema, table_name, 'PRIMARY KEY']
+            ).fetchall()]
+        # A single statement cannot update the same row twice, the last occurrence of each key wins as with MariaDB
+        df_to_upsert = self.pandas_df.drop_duplicates(subset=pk, keep='last')
+
+        columns = ', '.join('"{}"'.format(col) for col in df_to_upsert.columns)
+        updates = ', '.join('"{0}" = excluded."{0}"'.format(col) for col in df_to_upsert.columns if col not in pk)
+        keys = ', '.join('"{}"'.format(col) for col in pk)
+        join_keys = ' AND '.join('t."{0}" = s."{0}"'.format(col) for col in pk)
+        on_conflict = 'DO UPDATE SET {}'.format(updates) if updates else 'DO NOTHING'
+
+        staging_table = 'staging_{}'.format(table_name)
+        self.con.register('df_to_upsert', df_to_upsert)
+        try:
+            self.con.execute('BEGIN TRANSACTION')
+            try:
+                # Staging table has the column types of the table, so that keys are compared and merged on the same types
+                self.con.execute('CREATE OR REPLACE TEMPORARY TABLE "{0}" AS SELECT {1} FROM {2} LIMIT 0'.format(staging_table, columns, self._table(table_name)))
+                self.con.execute('INSERT INTO "{0}" ({1}) SELECT {1} FROM df_to_upsert'.format(staging_table, columns))
+                updated = self.con.execute(
+                    'SELECT count(*) FROM "{0}" s JOIN {1} t ON {2}'.format(staging_table, self._table(table_name), join_keys)
+                    ).fetchone()[0]
+                self.con.execute(
+                    'INSERT INTO {0} ({1}) SELECT {1} FROM "{2}" ON CONFLICT ({3}) {4}'.format(self._table(table_name), columns, staging_table, keys, on_conflict)
+                    )
+                self.con.execute('DROP TABLE "{0}"'.format(staging_table))
+                self._upserting_latest_snapshots(table_name)
+                self.con.execute('COMMIT')
+            except Exception:
+                self.con.execute('ROLLBACK')
+                raise
+        finally:
+            self.con.unregister('df_to_upsert')
+
+        upsert_stats = {'inserted': len(df_to_upsert) - updated, 'updated': updated}
+        self._logging.info("Upsert executed into {0}.{1}: {2} rows inserted, {3} rows updated".format(self.table_schema, table_name, upsert_stats['inserted'], upsert_stats['updated']))
+
+        self._saving_row_hashes()
+
+        return upsert_stats
+
+    def _upserting_latest_snapshots(self, table_name):
+        '''
+        Function that moves the latest_snapshots rows of the table forward, to be called within the transaction of the upsert.
+        Older snapshots (e.g. from a backfill) never move the pointer backwards.
+
+        :param table_name: table name
+        :type: str
+        :return: None
+        '''
+        df_latest = self._latest_snapshots(table_name)
+        if df_latest is None:
+            return
+
+        self.con.register('df_latest', df_latest)
+        try:
+            self.con.execute(
+                'INSERT INTO {0} (table_name, expiration_date, insert_date, update_time) '
+                'SELECT table_name, expiration_date, insert_date, update_time FROM df_latest '
+                'ON CONFLICT (table_name, expiration_date) DO UPDATE SET insert_date = greatest(insert_date, excluded.insert_date), update_time = excluded.update_time'
+                .format(self._table('latest_snapshots'))
+                )
+        finally:
+            self.con.unregister('df_latest')
+        self._logging.info("Latest snapshots of {0} refreshed for expiration dates {1}".format(table_name, df_latest['expiration_date'].tolist()))
+
+    def ReadLatestSnapshot(self, table_name, expiration_date):
+        '''
+        Function that reads the rows of the latest snapshot of the table for the expiration date, as recorded in latest_snapshots.
+
+        :param table_name: table name, one of data_ingestion.schema.SNAPSHOT_COLUMNS
+        :type: str
+        :param expiration_date: expiration date as stored in the table, e.g. 'GIU22' or '2022-06-01'
+        :type: str
+        :return: rows of the latest snapshot, empty if the table has never been loaded for the expiration date
+        :rtype: pandas.DataFrame
+        '''
+        row = self.con.execute(
+            'SELECT insert_date FROM {0} WHERE table_name = ? AND expiration_date = ?'.format(self._table('latest_snapshots')), [table_name, expiration_date]
+            ).fetchone()
+        if row is None:
+            self._logging.info("No snapshot of {0} recorded for expiration date {1}".format(table_name, expiration_date))
+            return pd.DataFrame(columns=[column.name for column in TABLES[table_name].columns])
+        df = self.con.execute(
+            'SELECT * FROM {0} WHERE expiration_date = CAST(? AS {1}) AND "{2}" = ?'.format(
+                self._table(table_name), duckdb_type(TABLES[table_name].c.expiration_date.type), SNAPSHOT_COLUMNS[table_name]
+                ),
+            [expiration_date, row[0]]
+            ).df()
+        self._logging.info("{0} rows read from the latest snapshot of {1} for expiration date {2}".format(len(df), table_name, expiration_date))
+
+        return df
+
+    def ReadTable(self, table_name, expiration_date = None, start_date = None, end_date = None, columns = None):
+        '''
+        Function that reads the rows of the table, optionally filtered by expiration date and by a range of snapshot dates.
+
+        :param table_name: table name
+        :type: str
+        :param expiration_date: expiration date as stored in the table, e.g. 'GIU22'. Default is None, meaning all
+        :type: str
+        :param start_date: first snapshot date to read, included. Only for tables in data_ingestion.schema.SNAPSHOT_COLUMNS. Default is None, meaning no lower bound
+        :type: str or datetime
+        :param end_date: last snapshot date to read, included. Only for tables in data_ingestion.schema.SNAPSHOT_COLUMNS. Default is None, meaning no upper bound
+        :type: str or datetime
+        :param columns: columns to read. Default is None, meaning all
+        :type: list
+        :return: rows of the table
+        :rtype: pandas.DataFrame
+        '''
+        filters, parameters = [], []
+        if expiration_date is not None:
+            filters.append('expiration_date = CAST(? AS {})'.format(duckdb_type(TABLES[table_name].c.expiration_date.type) if table_name in TABLES else 'VARCHAR'))
+            parameters.append(expiration_date)
+        if start_date is not None:
+            filters.append('"{}" >= CAST(? AS TIMESTAMP)'.format(SNAPSHOT_COLUMNS[table_name]))
+            parameters.append(str(start_date))
+        if end_date is not None:
+            filters.append('"{}" <= CAST(? AS TIMESTAMP)'.format(SNAPSHOT_COLUMNS[table_name]))
+            parameters.append(str(end_date))
+
+        query = 'SELECT {0} FROM {1}'.format('*' if columns is None else ', '.join('"{}"'.format(col) for col in columns), self._table(table_name))
+        if filters:
+            query += ' WHERE ' + ' AND '.join(filters)
+        df = self.con.execute(query, parameters).df()
+        self._logging.info("{0} rows read from table {1}".format(len(df), table_name))
+
+        return df
+
+    def ReadQuery(self, query, parameters = None):
+        '''
+        Function that runs a query on the database and returns its result, e.g. for local analytics.
+
+        :param query: SQL query, tables referenced with their catalog as returned by _table, e.g. "directa"."directa"."daily_options"
+        :type: str
+        :param parameters: parameters bound to the ? placeholders of the query
+        :type: list
+        :return: result of the query
+        :rtype: pandas.DataFrame
+        '''
+        return self.con.execute(query, parameters or []).df()
@@ -0,0 +1,100 @@
+import sys
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import Workbook
+from utils.utils import MyLogger
+
+
+class ExportWorker:
+
+    '''
+    ## Write the csv/xlsx side files of a run in a background thread, so that cleaning and DB upserts never wait on them
+    '''
+
+    def __init__(self, formats = ('csv', 'xlsx'), save_log = True):
+        '''
+        Constructor method
+
+        :param formats: file formats declared for this run, any of 'csv' and 'xlsx'. An empty tuple disables the side files
+        :type: tuple
+        '''
+        self.formats = tuple(formats)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export_worker')
+        self._futures = []
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/exports.log', name='exports')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='exports')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def submitting(self, description, func, *args, **kwargs):
+        '''
+        Function that queues a job to be run by the background thread.
+
+        :param description: description of the job, used for logging
+        :type: str
+        :param func: function to run
+        :type: callable
+        :return: None
+        '''
+        self._logging.info("Queueing {}".format(description))
+        self._futures.append((description, self._executor.submit(func, *args, **kwargs)))
+
+    @staticmethod
+    def writing_xlsx(df, path_xlsx):
+        '''
+        Function that writes a DataFrame to a xlsx file with openpyxl in write-only mode, streaming one row at a time.
+
+        :param df: DataFrame to write
+        :type: pandas.DataFrame
+        :param path_xlsx: path of the xlsx file
+        :type: str
+        :return: None
+        '''
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(list(df.columns))
+        for row in df.itertuples(index=False, name=None):
+            worksheet.append([None if pd.isna(value) else value for value in row])
+        workbook.save(path_xlsx)
+
+    def exporting(self, df, path_without_extension):
+        '''
+        Function that queues the export of a DataFrame in every format declared for this run.
+
+        :param df: DataFrame to export, a copy is taken so that the caller can keep working on it
+        :type: pandas.DataFrame
+        :param path_without_extension: path of the side files, without extension, e.g. data/options_table_clean
+        :type: str
+        :return: None
+        '''
+        if not self.formats:
+            return
+
+        df_export = df.copy()
+        if 'csv' in self.formats:
+            self.submitting('{}.csv'.format(path_without_extension), df_export.to_csv, '{}.csv'.format(path_without_extension), index=False)
+        if 'xlsx' in self.formats:
+            self.submitting('{}.xlsx'.format(path_without_extension), self.writing_xlsx, df_export, '{}.xlsx'.format(path_without_extension))
+
+    def waiting(self):
+        '''
+        Function that waits for every queued job. Failed jobs are logged without stopping the others.
+
+        :return: number of failed jobs
+        :rtype: int
+        '''
+        n_failed = 0
+        for description, future in self._futures:
+            try:
+                future.result()
+                self._logging.info("{} written".format(description))
+            except Exception as e:
+                n_failed += 1
+                self._logging.error("Writing {0} failed with: {1}".format(description, e))
+        self._futures = []
+
+        return n_failed
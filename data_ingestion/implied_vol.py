@@ -0,0 +1,179 @@
+import os, sys, time, pickle
+import numpy as np
+import pandas as pd
+from utils.utils import MyLogger, mkdir_p, save_to_pickle
+from data_ingestion.parsers import parse_expiration_codes, expiration_day
+from data_ingestion.pricing import black76, time_to_expiry
+
+
+class ImpliedVolSolver:
+
+    '''
+    ## Invert Black-76 prices into implied volatilities for every strike and option type of a chain at once.
+    Newton steps are taken on the whole chain together, each strike keeping a bracket of volatilities around its solution:
+    a step falling outside the bracket, or a vanishing vega, is replaced by a bisection of the bracket.
+    Volatilities solved by solving_chain are cached per expiration date and used as starting point for the next snapshot solved,
+    so that re-solving a chain whose prices moved little converges in a few iterations. Snapshots are solved by
+    DirectaDataPull.computing_greeks; IntradayPolling stores prices only and does not solve volatilities.
+    '''
+
+    # Volatilities searched, annualised
+    MIN_SIGMA = 1e-4
+    MAX_SIGMA = 5.0
+
+    def __init__(self, price_tolerance = 1e-4, max_iterations = 50, cache_dir = 'data/implied_vol', save_log = True):
+        '''
+        Constructor method
+
+        :param price_tolerance: largest difference between model and market price, in index points, for a strike to be considered solved
+        :type: float
+        :param max_iterations: largest number of iterations, strikes still unsolved afterwards are reported as not converged
+        :type: int
+        :param cache_dir: folder where the volatilities of the last snapshot of each expiration date are cached
+        :type: str
+        '''
+        self.price_tolerance = price_tolerance
+        self.max_iterations = max_iterations
+        self.cache_dir = cache_dir
+        # Volatilities of the last snapshot per expiration date, indexed by strike and option type
+        self._previous = {}
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/implied_vol.log', name='implied_vol')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='implied_vol')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def _cache_path(self, expiration_date):
+        '''
+        Path of the file caching the volatilities of the expiration date.
+        '''
+        return os.path.join(self.cache_dir, 'implied_vol_{}.pkl'.format(expiration_date))
+
+    def solving(self, prices, future, strike, years_to_expiry, is_call, rate = 0.0, sigma0 = None):
+        '''
+        Function that solves the implied volatilities of a set of options on the same future and expiry.
+        Prices outside the no-arbitrage bounds (below the discounted intrinsic value or above the discounted future/strike) have no solution.
+
+        :param prices: market prices
+        :type: numpy.ndarray
+        :param future: price of the future
+        :type: float
+        :param strike: strikes
+        :type: numpy.ndarray
+        :param years_to_expiry: years to expiry
+        :type: float
+        :param is_call: True for calls, False for puts
+        :type: numpy.ndarray
+        :param rate: continuously compounded risk-free rate used for discounting. Default is 0
+        :type: float
+        :param sigma0: starting volatilities, NaN where unknown. Default is None, meaning the at-the-money approximation for every strike
+        :type: numpy.ndarray
+        :return: volatilities (NaN where not converged), converged mask and number of iterations run
+        :rtype: tuple
+        '''
+        prices = np.asarray(prices, dtype=float)
+        strike = np.asarray(strike, dtype=float)
+        is_call = np.asarray(is_call, dtype=bool)
+        discount = np.exp(-rate * years_to_expiry)
+
+        intrinsic = discount * np.where(is_call, np.maximum(future - strike, 0), np.maximum(strike - future, 0))
+        upper_bound = discount * np.where(is_call, future, strike)
+        solvable = np.isfinite(prices) & (prices > intrinsic) & (prices < upper_bound)
+
+        # Brenner-Subrahmanyam at-the-money approximation where no previous volatility is known
+        sigma = np.sqrt(2 * np.pi / max(years_to_expiry, 1e-6)) * np.where(is_call, prices, prices + future - strike) / future
+        if sigma0 is not None:
+            sigma0 = np.asarray(sigma0, dtype=float)
+            sigma = np.where(np.isfinite(sigma0) & (sigma0 > 0), sigma0, sigma)
+        sigma = np.clip(np.nan_to_num(sigma, nan=0.2), self.MIN_SIGMA * 10, self.MAX_SIGMA / 2)
+
+        lower, upper = np.full_like(sigma, self.MIN_SIGMA), np.full_like(sigma, self.MAX_SIGMA)
+        converged = np.zeros(len(sigma), dtype=bool)
+        active = np.flatnonzero(solvable)
+        iterations = 0
+        while active.size > 0 and iterations < self.max_iterations:
+            iterations += 1
+            greeks = black76(future, strike[active], years_to_expiry, sigma[active], is_call[active], rate=rate)
+            diff = greeks['price'] - prices[active]
+            solved = np.abs(diff) < self.price_tolerance
+            converged[active[solved]] = True
+
+            # Price increases with volatility: the solution is below sigma when the model price is too high
+            lower[active] = np.where(diff < 0, sigma[active], lower[active])
+            upper[active] = np.where(diff > 0, sigma[active], upper[active])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = sigma[active] - diff / greeks['vega']
+            bisect = ~np.isfinite(newton) | (newton <= lower[active]) | (newton >= upper[active])
+            sigma[active] = np.where(solved, sigma[active], np.where(bisect, 0.5 * (lower[active] + upper[active]), newton))
+
+            active = active[~solved]
+
+        sigma[~converged] = np.nan
+
+        return sigma, converged, iterations
+
+    def solving_chain(self, df_options, future, snapshot_date = None, expiry = None, rate = 0.0):
+        '''
+        Function that solves the implied volatilities of an option ruler from its median prices, warm-started from the
+        volatilities of the previous snapshot of the same expiration date.
+
+        :param df_options: cleaned option ruler of one expiration date, as returned by DirectaDataPull.cleaning_options_data
+        :type: pandas.DataFrame
+        :param future: price of the future, as read from the option ruler header
+        :type: float
+        :param snapshot_date: date of the snapshot. Default is None, meaning the insert_date of df_options
+        :type: str or datetime
+        :param expiry: expiration day. Default is None, meaning the third Friday of the expiration month of df_options
+        :type: str or datetime
+        :param rate: continuously compounded risk-free rate used for discounting. Default is 0
+        :type: float
+        :return: volatilities aligned with df_options (NaN where not converged) and solve stats: seconds, iterations,
+            number of strikes, number of warm-started strikes, number of strikes not converged and the list of them
+        :rtype: tuple
+        '''
+        start = time.perf_counter()
+        expiration_date = df_options['expiration_date'].iloc[0]
+        snapshot_date = pd.to_datetime(df_options['insert_date'].iloc[0]) if snapshot_date is None else pd.to_datetime(snapshot_date)
+        if expiry is None:
+            expiry = expiration_day(parse_expiration_codes(pd.Series([expiration_date]))).iloc[0]
+
+        keys = pd.MultiIndex.from_arrays([df_options['strike'].to_numpy(), df_options['option_type'].astype(str).to_numpy()], names=['strike', 'option_type'])
+        previous = self._previous.get(expiration_date)
+        if previous is None and os.path.isfile(self._cache_path(expiration_date)):
+            with open(self._cache_path(expiration_date), 'rb') as f:
+                previous = pickle.load(f)
+        sigma0 = None if previous is None else previous.reindex(keys).to_numpy()
+
+        sigma, converged, iterations = self.solving(
+            df_options['median_price'].to_numpy(dtype=float), future, df_options['strike'].to_numpy(),
+            float(time_to_expiry(snapshot_date, expiry)), (df_options['option_type'].astype(str) == 'C').to_numpy(),
+            rate=rate, sigma0=sigma0
+            )
+
+        # Keeping previous volatilities of the strikes not solved this time, so that they can still warm-start the next snapshot
+        solved = pd.Series(sigma, index=keys)[converged]
+        solved = solved[~solved.index.duplicated(keep='last')]
+        if previous is not None:
+            solved = pd.concat([previous[~previous.index.isin(solved.index)], solved])
+        self._previous[expiration_date] = solved
+        mkdir_p(self._cache_path(expiration_date))
+        save_to_pickle(solved, self._cache_path(expiration_date))
+
+        has_price = np.isfinite(df_options['median_price'].to_numpy(dtype=float))
+        not_converged = df_options.loc[has_price & ~converged, ['strike', 'option_type']]
+        stats = {
+            'seconds': time.perf_counter() - start,
+            'iterations': iterations,
+            'n_strikes': int(has_price.sum()),
+            'n_warm_started': 0 if sigma0 is None else int(np.isfinite(sigma0).sum()),
+            'n_not_converged': len(not_converged),
+            'not_converged': list(not_converged.itertuples(index=False, name=None)),
+            }
+        self._logging.info("Implied volatilities of {0} solved in {1:.4f} seconds and {2} iterations: {3} strikes, {4} warm-started, {5} not converged".format(
+            expiration_date, stats['seconds'], iterations, stats['n_strikes'], stats['n_warm_started'], stats['n_not_converged']
+            ))
+
+        return sigma, stats
@@ -0,0 +1,162 @@
+import sys, time, argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import rpa as r
+from utils.utils import MyLogger
+from data_ingestion.db_utils import TABLES_DATA_TYPES
+from data_ingestion.storage import get_backend
+from data_ingestion.directa_data_pull import DirectaDataPull
+from data_ingestion.parsers import parse_option_ruler
+
+
+class IntradayPolling:
+
+    '''
+    ## Keep the Directa session open and re-read the option ruler every few minutes, writing only the rows whose prices or delta changed
+    since the previous snapshot into a timestamp-keyed table
+    '''
+
+    # Columns compared between two snapshots to decide whether a row has changed
+    CHANGE_COLS = ['bid', 'ask', 'median_price', 'delta']
+    KEY_COLS = ['strike', 'option_type']
+    SQL_PK = ['strike', 'option_type', 'expiration_date', 'snapshot_time']
+
+    def __init__(self, pull_obj, table_schema = 'directa', table_name = 'intraday_options', interval_minutes = 5, save_log = True, backend = 'mariadb'):
+        '''
+        Constructor method
+
+        :param pull_obj: DirectaDataPull object used to drive the web session
+        :type: DirectaDataPull
+        :param interval_minutes: minutes between two snapshots
+        :type: float
+        :param backend: storage backend, either 'mariadb' or 'duckdb'
+        :type: str
+        '''
+        self.pull_obj = pull_obj
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.interval_minutes = interval_minutes
+        self.backend = backend
+        # Last snapshot, indexed by strike and option type
+        self.previous_snapshot = None
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/intraday.log', name='intraday')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='intraday')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def reading_snapshot(self, session):
+        '''
+        Function that reads the option ruler currently shown on the page and returns it as a long DataFrame.
+
+        :param session: RPA session object
+        :return: snapshot having one row per strike and option type
+        :rtype: pandas.DataFrame
+        '''
+        csv_name = self.pull_obj.downloading_option_ruler(session, self.pull_obj.current_exp_date)
+        columns, future = parse_option_ruler('data/{}'.format(csv_name), float_dtype=np.float64)
+        df = pd.DataFrame(columns)
+        df['option_type'] = df['option_type'].astype(str)
+        df['expiration_date'] = self.pull_obj.current_exp_date
+        df['future'] = future
+        df['snapshot_time'] = datetime.now().replace(microsecond=0)
+
+        return df
+
+    def diffing(self, df_snapshot):
+        '''
+        Function that compares a snapshot with the previous one and keeps the rows that are new or whose CHANGE_COLS changed.
+        Two missing values are considered equal. The previous snapshot is moved forward by committing, once the changes have been written.
+
+        :param df_snapshot: snapshot returned by reading_snapshot
+        :type: pandas.DataFrame
+        :return: changed rows
+        :rtype: pandas.DataFrame
+        '''
+        current = df_snapshot.set_index(self.KEY_COLS)
+        if self.previous_snapshot is None:
+            changed = np.ones(len(current), dtype=bool)
+        else:
+            previous = self.previous_snapshot.reindex(current.index)
+            new_values = current[self.CHANGE_COLS].to_numpy(dtype=float)
+            old_values = previous[self.CHANGE_COLS].to_numpy(dtype=float)
+            unchanged = (new_values == old_values) | (np.isnan(new_values) & np.isnan(old_values))
+            changed = ~unchanged.all(axis=1)
+
+        return df_snapshot[changed]
+
+    def committing(self, df_snapshot):
+        '''
+        Function that makes the snapshot the reference of the next diffing. To be called only once its changes have been written,
+        so that changes of a failed write are sent again with the next snapshot.
+
+        :param df_snapshot: snapshot returned by reading_snapshot
+        :type: pandas.DataFrame
+        :return: None
+        '''
+        self.previous_snapshot = df_snapshot.set_index(self.KEY_COLS)
+
+    def writing(self, df_changes):
+        '''
+        Function that upserts the changed rows into the intraday table.
+
+        :param df_changes: rows returned by diffing
+        :type: pandas.DataFrame
+        :return: None
+        '''
+        db_class = get_backend(self.backend, self.table_schema, df_changes)
+        db_class.LoadTable(self.table_name, pk = self.SQL_PK, data_types=TABLES_DATA_TYPES[self.table_name])
+        db_class.UpdateInsertTable(self.table_name)
+
+    def polling(self, n_snapshots = None, until = None):
+        '''
+        Function that logs in once, moves to the option ruler of the expiration date of interest and then takes a snapshot every interval_minutes,
+        writing only the changed rows. A failing snapshot (page or DB error) is logged and skipped, so that the session keeps running.
+
+        :param n_snapshots: number of snapshots to take. Default is None, meaning no limit
+        :type: int
+        :param until: time after which polling stops, e.g. datetime(2022, 3, 31, 17, 30). Default is None, meaning no limit
+        :type: datetime
+        :return: None
+        '''
+        self.pull_obj.logging_in_directa()
+        try:
+            self.pull_obj.downloading_market_prices(r)
+            i = 0
+            while (n_snapshots is None or i < n_snapshots) and (until is None or datetime.now() < until):
+                start = time.perf_counter()
+                try:
+                    df_snapshot = self.reading_snapshot(r)
+                    df_changes = self.diffing(df_snapshot)
+                    self._logging.info("Snapshot {0}: {1} rows changed out of {2}".format(i, len(df_changes), len(df_snapshot)))
+                    if len(df_changes) > 0:
+                        self.writing(df_changes)
+                    self.committing(df_snapshot)
+                except Exception as e:
+                    self._logging.error("Snapshot {0} failed with: {1} | Changes will be sent with the next snapshot".format(i, e))
+                i += 1
+                time.sleep(max(0, self.interval_minutes * 60 - (time.perf_counter() - start)))
+        finally:
+            r.close()
+            self._logging.info("Closing the web session")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll the Directa option ruler and store the changed rows')
+    parser.add_argument('--expiration', default='GIU22', help='expiration date of interest, e.g. GIU22')
+    parser.add_argument('--interval', type=float, default=5, help='minutes between two snapshots')
+    parser.add_argument('--until', default=None, help='time after which polling stops, format HH:MM')
+    parser.add_argument('--backend', default='mariadb', choices=['mariadb', 'duckdb'], help='storage backend the snapshots are written into')
+    args = parser.parse_args()
+
+    until = None
+    if args.until is not None:
+        until = datetime.combine(datetime.now().date(), datetime.strptime(args.until, '%H:%M').time())
+
+    pull_obj = DirectaDataPull(save_log=True, expiration_date_of_interest=args.expiration, exports=())
+    polling_obj = IntradayPolling(pull_obj, interval_minutes=args.interval, backend=args.backend)
+    polling_obj.polling(until=until)
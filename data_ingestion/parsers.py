@@ -0,0 +1,141 @@
+import io, csv, re
+import pandas as pd
+import numpy as np
+
+
+# Columns of the option ruler table downloaded from Directa, calls on the left of the strike and puts on the right
+OPTION_RULER_COLS = [
+    'call_delta', 'call_volume', 'call_bid', 'call_median_price', 'call_ask', 'call_open_interest', 'call_price', 'strike',
+    'put_price', 'put_volume', 'put_bid', 'put_median_price', 'put_ask', 'put_open_interest', 'put_delta'
+    ]
+# Columns shared by both legs, in the order used by the cleaned DataFrame
+OPTION_LEG_COLS = ['delta', 'volume', 'bid', 'median_price', 'ask', 'open_interest', 'price']
+
+# Description of an option position in 'tabellone', e.g. 'OPZ.STX50 P 3850 2206': underlying after the dot, then option type, strike and expiration as yymm
+TABELLONE_DESCRIPTION_PATTERN = re.compile(
+    r'^\s*(?:[^\s".]*[".])?(?P<underlying_asset>[^\s".]+)\S*\s+'
+    r'(?P<option_type>\S+)\s+'
+    r'(?P<strike>\d+)\s+'
+    r'(?P<expiration_year>\d{2})(?P<expiration_month>\d{2})'
+    )
+
+# Italian month abbreviations used by Directa in the expiration dates of the option ruler, e.g. 'GIU22'
+ITALIAN_MONTHS = {
+    'GEN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAG': 5, 'GIU': 6,
+    'LUG': 7, 'AGO': 8, 'SET': 9, 'OTT': 10, 'NOV': 11, 'DIC': 12
+    }
+
+
+def parse_option_ruler(csv_path, float_dtype = np.float32):
+    '''
+    Function that parses the option ruler csv file downloaded from Directa in a single read.
+    The header row carries the future price, the body carries calls and puts side by side: both legs are stacked
+    into typed columnar arrays, calls first and puts after, without building intermediate DataFrames.
+
+    :param csv_path: path of the option ruler csv file
+    :type: str
+    :param float_dtype: numpy dtype used for prices, volumes, open interest and delta. Default is numpy.float32
+    :type: numpy.dtype
+    :return: dict of numpy arrays (strike as int32, option_type as pandas.Categorical) and the future price
+    :rtype: tuple
+    '''
+    with open(csv_path, 'r', encoding='utf-8') as fp:
+        text = fp.read()
+
+    # Future price is the fourth cell of the header, e.g. '3.850,50\n+0,12%'
+    header = next(csv.reader(io.StringIO(text)))
+    future = header[3]
+    future = float(future[:future.rfind('\n')].replace('.', '').replace(',', '.'))
+
+    dtypes = {col: float_dtype for col in OPTION_RULER_COLS}
+    dtypes['strike'] = np.int32
+    df = pd.read_csv(
+        io.StringIO(text), skiprows=5, names=OPTION_RULER_COLS, dtype=dtypes,
+        thousands='.', decimal=',', usecols=np.arange(1, 16), na_values=['·', 'close']
+        )
+
+    n_strikes = len(df)
+    columns = {}
+    for col in OPTION_LEG_COLS:
+        columns[col] = np.concatenate([df['call_' + col].to_numpy(), df['put_' + col].to_numpy()])
+    strike = df['strike'].to_numpy()
+    columns['strike'] = np.concatenate([strike, strike])
+    columns['option_type'] = pd.Categorical.from_codes(
+        np.repeat(np.array([0, 1], dtype=np.int8), n_strikes), categories=['C', 'P']
+        )
+
+    return columns, future
+
+
+def parse_tabellone_description(description):
+    '''
+    Function that extracts underlying asset, option type, strike and expiration date from the description of the positions in 'tabellone',
+    with a single regex pass over the whole column.
+
+    :param description: column containing the descriptions, e.g. 'OPZ.STX50 P 3850 2206'
+    :type: pandas.Series
+    :return: DataFrame with columns underlying_asset, expiration_date, option_type and strike, aligned with description
+    :rtype: pandas.DataFrame
+    '''
+    df = description.str.extract(TABELLONE_DESCRIPTION_PATTERN)
+    df['expiration_date'] = pd.to_datetime(df['expiration_year'] + '-' + df['expiration_month'], format='%y-%m')
+    df['strike'] = pd.to_numeric(df['strike'])
+
+    return df[['underlying_asset', 'expiration_date', 'option_type', 'strike']]
+
+
+def parse_expiration_codes(expiration_codes):
+    '''
+    Function that converts the expiration dates of the option ruler (e.g. 'GIU22') into the first day of the month,
+    as stored for positions and greeks, without relying on the process-wide locale.
+
+    :param expiration_codes: column containing the expiration dates, e.g. 'GIU22'
+    :type: pandas.Series
+    :return: first day of the expiration month, NaT when the code is not recognised
+    :rtype: pandas.Series
+    '''
+    codes = expiration_codes.astype(str).str.upper()
+    month = codes.str[:3].map(ITALIAN_MONTHS)
+    year = pd.to_numeric(codes.str[3:], errors='coerce') + 2000
+
+    return pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': 1}), errors='coerce')
+
+
+def expiration_day(expiration_months):
+    '''
+    Function that returns the expiration day of index options, the third Friday of the expiration month.
+
+    :param expiration_months: first day of the expiration months, e.g. as returned by parse_expiration_codes
+    :type: pandas.Series or pandas.DatetimeIndex
+    :return: third Friday of each month
+    :rtype: same type as expiration_months
+    '''
+    expiration_months = pd.to_datetime(expiration_months)
+    weekday = expiration_months.dt.weekday if isinstance(expiration_months, pd.Series) else expiration_months.weekday
+
+    return expiration_months + pd.to_timedelta((4 - weekday) % 7 + 14, unit='D')
+
+
+def parse_italian_numbers(df):
+    '''
+    Function that converts numbers written in the italian format (e.g. '+1.234,50 €', '-3,2%') into floats,
+    without relying on the process-wide locale so that it can run in threads.
+
+    :param df: DataFrame whose columns have to be converted
+    :type: pandas.DataFrame
+    :return: DataFrame of floats, values that cannot be converted are set to NaN
+    :rtype: pandas.DataFrame
+    '''
+    df_numbers = df.copy()
+    for col in df_numbers.columns:
+        if pd.api.types.is_numeric_dtype(df_numbers[col]):
+            continue
+        df_numbers[col] = pd.to_numeric(
+            df_numbers[col].astype(str)
+                .str.replace(r'[+%€\s]', '', regex=True)
+                .str.replace('.', '', regex=False)
+                .str.replace(',', '.', regex=False),
+            errors='coerce'
+            )
+
+    return df_numbers.astype(float)
@@ -0,0 +1,145 @@
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from utils.utils import MyLogger
+from data_ingestion.storage import get_backend
+from data_ingestion.parsers import parse_expiration_codes
+
+
+class PortfolioSeries:
+
+    '''
+    ## Append the net delta, gamma, theta, vega and mark-to-market of the open positions to a time series at the end of each ingestion.
+    Only the cleaned frames of the current snapshot are used, so each run costs O(positions) instead of re-aggregating the whole
+    history of daily_options as the delta by trade date query of queries/time_decay.sql.
+    '''
+
+    KEY_COLS = ['strike', 'option_type', 'expiration_date']
+    SQL_PK = ['insert_date']
+    # Value of one index point of the options, as in time_decay.sql
+    MULTIPLIER = 10
+
+    def __init__(self, table_schema = 'directa', table_name = 'portfolio_timeseries', backend = 'mariadb', save_log = True):
+        '''
+        Constructor method
+
+        :param backend: storage backend the time series is written into, either 'mariadb' or 'duckdb'
+        :type: str
+        '''
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.backend = backend
+        self.save_log = save_log
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/portfolio.log', name='portfolio')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='portfolio')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    def _keyed(self, df):
+        '''
+        Function that aligns strike and option type dtypes of the frames joined on KEY_COLS.
+        '''
+        df = df.copy()
+        df['strike'] = df['strike'].astype(np.int64)
+        df['option_type'] = df['option_type'].astype(str)
+
+        return df
+
+    @staticmethod
+    def _net(values, qty):
+        '''
+        Function that sums values weighted by quantity over the positions having a value, NaN (stored as NULL) when none of them has one,
+        so that a snapshot without greeks is not mistaken for a flat book.
+        '''
+        weighted = values * qty
+        if not np.isfinite(weighted).any():
+            return np.nan
+
+        return np.nansum(weighted)
+
+    def computing(self, df_options, df_positions, df_greeks = None, snapshot_date = None):
+        '''
+        Function that computes the net greeks and mark-to-market of the open positions for the snapshot.
+        Delta and prices come from the option ruler, gamma, theta and vega from the greeks, delta falling back to the greeks one
+        when missing from the ruler. Positions without a price or greeks are counted but do not contribute; net values are missing
+        when no position contributes (e.g. gamma, theta and vega when df_greeks is None).
+
+        :param df_options: cleaned option ruler, as returned by DirectaDataPull.cleaning_all_options_data
+        :type: pandas.DataFrame
+        :param df_positions: cleaned positions, as returned by DirectaDataPull.cleaning_tabellone_data
+        :type: pandas.DataFrame
+        :param df_greeks: cleaned greeks, as returned by DirectaDataPull.cleaning_greeks_data. Default is None, meaning no greeks for this snapshot
+        :type: pandas.DataFrame
+        :param snapshot_date: date of the snapshot, format 'yyyy-mm-dd'. Default is None, meaning the insert_date of df_options
+        :type: str
+        :return: one row with the columns of portfolio_timeseries
+        :rtype: pandas.DataFrame
+        '''
+        snapshot_date = pd.to_datetime(df_options['insert_date']).max() if snapshot_date is None else pd.to_datetime(snapshot_date)
+
+        df_book = self._keyed(df_positions.loc[df_positions['qty'].fillna(0) != 0, self.KEY_COLS + ['qty', 'price']])
+        df_book['expiration_date'] = pd.to_datetime(df_book['expiration_date'])
+
+        df_prices = self._keyed(df_options[['strike', 'option_type', 'median_price', 'delta']])
+        df_prices['expiration_date'] = parse_expiration_codes(df_options['expiration_date']).to_numpy()
+        df_book = df_book.merge(df_prices.drop_duplicates(self.KEY_COLS, keep='last'), on=self.KEY_COLS, how='left')
+
+        greeks_cols = ['delta', 'gamma', 'theta', 'vega']
+        if df_greeks is not None:
+            df_greeks = self._keyed(df_greeks[self.KEY_COLS + greeks_cols])
+            df_greeks['expiration_date'] = pd.to_datetime(df_greeks['expiration_date'])
+            df_book = df_book.merge(df_greeks.drop_duplicates(self.KEY_COLS, keep='last'), on=self.KEY_COLS, how='left', suffixes=('', '_greeks'))
+            df_book['delta'] = df_book['delta'].fillna(df_book['delta_greeks'])
+        else:
+            for col in greeks_cols[1:]:
+                df_book[col] = np.nan
+
+        qty = df_book['qty'].to_numpy(dtype=float)
+        median_price = df_book['median_price'].to_numpy(dtype=float)
+        df_row = pd.DataFrame({
+            'insert_date': [snapshot_date],
+            'net_delta': [self._net(df_book['delta'].to_numpy(dtype=float), qty)],
+            'net_gamma': [self._net(df_book['gamma'].to_numpy(dtype=float), qty)],
+            'net_theta': [self._net(df_book['theta'].to_numpy(dtype=float), qty)],
+            'net_vega': [self._net(df_book['vega'].to_numpy(dtype=float), qty)],
+            'market_value': [self._net(median_price, qty) * self.MULTIPLIER],
+            'mtm_pnl': [self._net(median_price - df_book['price'].to_numpy(dtype=float), qty) * self.MULTIPLIER],
+            'n_positions': [len(df_book)],
+            'n_priced': [int(np.isfinite(median_price).sum())],
+            'n_with_greeks': [int(df_book['gamma'].notna().sum())],
+            'update_time': [datetime.now()],
+            })
+        self._logging.info("Portfolio on {0}: net delta {1:.4f}, net gamma {2:.6f}, net theta {3:.4f}, MTM {4:.2f} over {5} positions".format(
+            snapshot_date.date(), df_row['net_delta'].iloc[0], df_row['net_gamma'].iloc[0], df_row['net_theta'].iloc[0], df_row['mtm_pnl'].iloc[0], len(df_book)
+            ))
+
+        return df_row
+
+    def appending(self, df_row):
+        '''
+        Function that upserts the row of the snapshot into the time series, a run repeated on the same day replacing the previous row.
+
+        :param df_row: row returned by computing
+        :type: pandas.DataFrame
+        :return: None
+        '''
+        db_class = get_backend(self.backend, self.table_schema, df_row, save_log=self.save_log)
+        db_class.LoadTable(self.table_name, pk = self.SQL_PK)
+        db_class.UpdateInsertTable(self.table_name)
+
+    def updating(self, df_options, df_positions, df_greeks = None, snapshot_date = None):
+        '''
+        Function that computes the row of the snapshot and appends it to the time series. See computing for the parameters.
+
+        :return: row appended
+        :rtype: pandas.DataFrame
+        '''
+        df_row = self.computing(df_options, df_positions, df_greeks=df_greeks, snapshot_date=snapshot_date)
+        self.appending(df_row)
+
+        return df_row
@@ -0,0 +1,130 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from data_ingestion.parsers import parse_expiration_codes, expiration_day
+
+
+# Calendar days per year, time to expiry is ACT/365
+DAYS_PER_YEAR = 365.0
+# Shortest time to expiry used in the formulas, so that options on their expiration day keep finite greeks
+MIN_TIME_TO_EXPIRY = 1e-6
+
+
+def black76(future, strike, time_to_expiry, sigma, is_call, rate = 0.0):
+    '''
+    Function that prices options on futures with the Black-76 model, together with their greeks.
+    Inputs are broadcast against each other, so a whole chain is priced with a single call.
+
+    :param future: price of the future
+    :type: float or numpy.ndarray
+    :param strike: strikes
+    :type: numpy.ndarray
+    :param time_to_expiry: years to expiry
+    :type: float or numpy.ndarray
+    :param sigma: volatilities, annualised (e.g. 0.2 for 20%)
+    :type: float or numpy.ndarray
+    :param is_call: True for calls, False for puts
+    :type: bool or numpy.ndarray
+    :param rate: continuously compounded risk-free rate used for discounting. Default is 0
+    :type: float
+    :return: dict of arrays: price, delta, gamma, theta (per year) and vega (per unit of volatility)
+    :rtype: dict
+    '''
+    future, strike, time_to_expiry, sigma, is_call = np.broadcast_arrays(
+        np.asarray(future, dtype=float), np.asarray(strike, dtype=float),
+        np.maximum(np.asarray(time_to_expiry, dtype=float), MIN_TIME_TO_EXPIRY), np.asarray(sigma, dtype=float), np.asarray(is_call, dtype=bool)
+        )
+    sqrt_t = np.sqrt(time_to_expiry)
+    vol_sqrt_t = sigma * sqrt_t
+    discount = np.exp(-rate * time_to_expiry)
+
+    # Zero volatilities or times to expiry give NaN greeks instead of warnings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1 = (np.log(future / strike) + 0.5 * sigma ** 2 * time_to_expiry) / vol_sqrt_t
+        d2 = d1 - vol_sqrt_t
+        pdf_d1 = np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi)
+
+        call = discount * (future * ndtr(d1) - strike * ndtr(d2))
+        put = discount * (strike * ndtr(-d2) - future * ndtr(-d1))
+        price = np.where(is_call, call, put)
+        gamma = discount * pdf_d1 / (future * vol_sqrt_t)
+
+    return {
+        'price': price,
+        'delta': np.where(is_call, discount * ndtr(d1), -discount * ndtr(-d1)),
+        'gamma': gamma,
+        'theta': -discount * future * pdf_d1 * sigma / (2 * sqrt_t) + rate * price,
+        'vega': discount * future * pdf_d1 * sqrt_t,
+        }
+
+
+def time_to_expiry(snapshot_date, expiry):
+    '''
+    Function that computes the years between the snapshot and the expiry, ACT/365.
+
+    :param snapshot_date: date of the snapshot
+    :type: str or datetime or pandas.Series
+    :param expiry: expiration day
+    :type: str or datetime or pandas.Series
+    :return: years to expiry
+    :rtype: float or numpy.ndarray
+    '''
+    days = (pd.to_datetime(expiry) - pd.to_datetime(snapshot_date)) / pd.Timedelta(days=1)
+
+    return np.asarray(days, dtype=float) / DAYS_PER_YEAR
+
+
+def chain_greeks(df_options, future, sigma, snapshot_date = None, expiry = None, rate = 0.0):
+    '''
+    Function that computes the greeks of an option ruler with Black-76, in the format of the greeks_options table,
+    so that the chain can be loaded without downloading greeks from BarChart.com.
+    IV and IV_skew are in percentage points as in the BarChart.com file, theta is per calendar day and vega per volatility point.
+
+    :param df_options: cleaned option ruler of one expiration date, as returned by DirectaDataPull.cleaning_options_data
+    :type: pandas.DataFrame
+    :param future: price of the future, as read from the option ruler header
+    :type: float
+    :param sigma: volatilities, annualised, one per row of df_options or a single one for the whole chain
+    :type: float or numpy.ndarray
+    :param snapshot_date: date of the snapshot. Default is None, meaning the insert_date of df_options
+    :type: str or datetime
+    :param expiry: expiration day. Default is None, meaning the third Friday of the expiration month of df_options
+    :type: str or datetime
+    :param rate: continuously compounded risk-free rate used for discounting. Default is 0
+    :type: float
+    :return: DataFrame with the columns of greeks_options
+    :rtype: pandas.DataFrame
+    '''
+    expiration_month = parse_expiration_codes(df_options['expiration_date'].iloc[:1]).iloc[0]
+    snapshot_date = pd.to_datetime(df_options['insert_date'].iloc[0]) if snapshot_date is None else pd.to_datetime(snapshot_date)
+    expiry = expiration_day(pd.Series([expiration_month])).iloc[0] if expiry is None else pd.to_datetime(expiry)
+
+    strike = df_options['strike'].to_numpy()
+    is_call = (df_options['option_type'].astype(str) == 'C').to_numpy()
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), strike.shape)
+    greeks = black76(future, strike, time_to_expiry(snapshot_date, expiry), sigma, is_call, rate=rate)
+
+    iv = sigma * 100
+    # Skew against the volatility of the strike closest to the future, per option type
+    atm_iv = np.full_like(iv, np.nan)
+    for option_type_mask in [is_call, ~is_call]:
+        valid = option_type_mask & np.isfinite(iv)
+        if valid.any():
+            atm_index = np.flatnonzero(valid)[np.argmin(np.abs(strike[valid] - future))]
+            atm_iv[option_type_mask] = iv[atm_index]
+
+    return pd.DataFrame({
+        'strike': strike,
+        'option_type': df_options['option_type'].astype(str).to_numpy(),
+        'last': df_options['median_price'].to_numpy(dtype=float),
+        'IV': iv,
+        'delta': greeks['delta'],
+        'gamma': greeks['gamma'],
+        'theta': greeks['theta'] / DAYS_PER_YEAR,
+        'vega': greeks['vega'] / 100,
+        'IV_skew': iv - atm_iv,
+        'insert_date': snapshot_date.normalize(),
+        'expiration_date': expiration_month,
+        'update_time': datetime.now(),
+        })
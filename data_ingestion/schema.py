@@ -0,0 +1,117 @@
+'''
+Declarative schema of the tables loaded by the ingestion, applied and migrated by the storage backends (see StorageBackend.ApplySchema)
+instead of being inferred from the first DataFrame loaded.
+Secondary indexes follow the access paths of queries/time_decay.sql: latest insert_date/update_time, expiration date filters
+and joins on (strike, option_type).
+'''
+from datetime import date
+from sqlalchemy import MetaData, Table, Column, Index, PrimaryKeyConstraint
+from sqlalchemy import String, Integer, Float, DateTime
+
+
+metadata = MetaData()
+
+# Prices, greeks and quantities are stored as double, as returned by the cleaning functions
+Double = Float(precision=53)
+
+TABLES = {
+    'daily_options': Table(
+        'daily_options', metadata,
+        Column('delta', Double), Column('volume', Double), Column('bid', Double), Column('median_price', Double),
+        Column('ask', Double), Column('open_interest', Double), Column('price', Double),
+        Column('strike', Integer, nullable=False), Column('option_type', String(10), nullable=False),
+        Column('insert_date', DateTime, nullable=False), Column('update_time', DateTime),
+        Column('expiration_date', String(10), nullable=False),
+        PrimaryKeyConstraint('strike', 'insert_date', 'expiration_date', 'option_type'),
+        Index('ix_daily_options_insert_date', 'insert_date'),
+        Index('ix_daily_options_expiration_insert', 'expiration_date', 'insert_date'),
+        Index('ix_daily_options_strike_type', 'strike', 'option_type'),
+        ),
+    'open_position_options': Table(
+        'open_position_options', metadata,
+        Column('symbol', String(50)), Column('description', String(100)), Column('current_price', Double),
+        Column('benchmark', Double), Column('trend_perc', Double), Column('qty', Double), Column('price', Double),
+        Column('gain_loss_abs', Double), Column('gain_loss_perc', Double), Column('recovery', Double),
+        Column('purchase_date', DateTime, nullable=False), Column('underlying_asset', String(10), nullable=False),
+        Column('expiration_date', DateTime, nullable=False), Column('option_type', String(10), nullable=False),
+        Column('strike', Integer, nullable=False), Column('update_time', DateTime),
+        PrimaryKeyConstraint('strike', 'purchase_date', 'expiration_date', 'option_type', 'underlying_asset'),
+        Index('ix_open_position_options_update_time', 'update_time'),
+        Index('ix_open_position_options_strike_type', 'strike', 'option_type'),
+        ),
+    'calendar_options': Table(
+        'calendar_options', metadata,
+        Column('strike', Integer, nullable=False), Column('expiration_date', DateTime, nullable=False),
+        Column('price', Double), Column('option_type', String(10), nullable=False), Column('insert_date', DateTime),
+        PrimaryKeyConstraint('strike', 'expiration_date', 'option_type'),
+        Index('ix_calendar_options_insert_date', 'insert_date'),
+        Index('ix_calendar_options_strike_type', 'strike', 'option_type'),
+        ),
+    'greeks_options': Table(
+        'greeks_options', metadata,
+        Column('strike', Integer, nullable=False), Column('option_type', String(10), nullable=False),
+        Column('last', Double), Column('IV', Double), Column('delta', Double), Column('gamma', Double),
+        Column('theta', Double), Column('vega', Double), Column('IV_skew', Double),
+        Column('insert_date', DateTime, nullable=False), Column('expiration_date', DateTime, nullable=False),
+        Column('update_time', DateTime),
+        # 'barchart' for the BarChart.com file, 'black76' for greeks computed locally from the option ruler (NULL for rows loaded before the column existed)
+        Column('source', String(10)),
+        PrimaryKeyConstraint('strike', 'option_type', 'expiration_date', 'insert_date'),
+        Index('ix_greeks_options_update_time', 'update_time'),
+        Index('ix_greeks_options_expiration_insert', 'expiration_date', 'insert_date'),
+        Index('ix_greeks_options_strike_type', 'strike', 'option_type'),
+        ),
+    # Net greeks and mark-to-market of the open positions, one row per snapshot appended at the end of each ingestion (see data_ingestion.portfolio)
+    'portfolio_timeseries': Table(
+        'portfolio_timeseries', metadata,
+        Column('insert_date', DateTime, nullable=False),
+        Column('net_delta', Double), Column('net_gamma', Double), Column('net_theta', Double), Column('net_vega', Double),
+        Column('market_value', Double), Column('mtm_pnl', Double),
+        Column('n_positions', Integer), Column('n_priced', Integer), Column('n_with_greeks', Integer),
+        Column('update_time', DateTime),
+        PrimaryKeyConstraint('insert_date'),
+        ),
+    # Latest snapshot date of each table and expiration date, refreshed in the same transaction as the upsert of the table,
+    # so that the current chain is read with a point lookup instead of a max(insert_date) subquery
+    'latest_snapshots': Table(
+        'latest_snapshots', metadata,
+        Column('table_name', String(64), nullable=False), Column('expiration_date', String(10), nullable=False),
+        Column('insert_date', DateTime, nullable=False), Column('update_time', DateTime),
+        PrimaryKeyConstraint('table_name', 'expiration_date'),
+        ),
+    }
+
+# Column holding the snapshot date of the tables tracked in latest_snapshots. Only tables having the column in their primary key:
+# calendar_options keeps one row per (strike, expiration_date, option_type) whose insert_date is the last time the row changed,
+# so it is a current-state table to be read as a whole rather than a snapshot table
+SNAPSHOT_COLUMNS = {
+    'daily_options': 'insert_date',
+    'greeks_options': 'insert_date',
+    }
+
+# Tables range-partitioned by month on the column, where supported by the backend. The column belongs to the primary key, as required by MariaDB
+PARTITIONED_TABLES = {
+    'daily_options': 'insert_date',
+    'greeks_options': 'insert_date',
+    }
+
+
+def monthly_partitions(start, end):
+    '''
+    Function that lists the monthly range partitions covering the dates from start to end, one per month.
+
+    :param start: first date to cover
+    :type: datetime.date
+    :param end: last date to cover
+    :type: datetime.date
+    :return: list of tuples (partition name, first day of the following month), e.g. ('p202203', date(2022, 4, 1))
+    :rtype: list
+    '''
+    partitions = []
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        partitions.append(('p{}'.format(month.strftime('%Y%m')), next_month))
+        month = next_month
+
+    return partitions
@@ -0,0 +1,224 @@
+import os, pickle
+from abc import ABC, abstractmethod
+from datetime import datetime
+import pandas as pd
+from utils.utils import mkdir_p, save_to_pickle
+from data_ingestion.schema import SNAPSHOT_COLUMNS
+
+
+class StorageBackend(ABC):
+
+    '''
+    ## Interface shared by the storage backends: every backend loads a cleaned DataFrame into a table with its own native upsert.
+    Subclasses set self.table_schema, self.pandas_df and self._logging in their constructor.
+    '''
+
+    # Folder where DropUnchangedRows stores the row hashes of each table
+    ROW_HASHES_FOLDER = 'data/row_hashes'
+
+    @abstractmethod
+    def ApplySchema(self, table_name):
+        '''
+        Function that creates the table as declared in data_ingestion.schema, or migrates the existing one to it
+        (missing columns, indexes and partitions are added).
+
+        :param table_name: table name, one of data_ingestion.schema.TABLES
+        :type: str
+        :return: None
+        '''
+
+    @abstractmethod
+    def LoadTable(self, table_name, pk, data_types = None):
+        '''
+        Function that creates the table with its primary key, if it does not exist yet.
+        Tables declared in data_ingestion.schema are applied with ApplySchema, the others are inferred from the DataFrame.
+
+        :param table_name: table name
+        :type: str
+        :param pk: primary key of the table
+        :type: list
+        :param data_types: sqlalchemy data types forced on some columns (e.g. {'strike': Integer()})
+        :type: dict
+        :return: None
+        '''
+
+    @abstractmethod
+    def UpdateInsertTable(self, table_name, batch_size = 1000):
+        '''
+        Function that performs Upserts of the DataFrame on the table, based on its primary key.
+
+        :param table_name: table name
+        :type: str
+        :param batch_size: number of rows sent at each round trip, for backends that need it
+        :type: int
+        :return: number of rows inserted and updated
+        :rtype: dict
+        '''
+
+    @abstractmethod
+    def TableFingerprint(self, table_name):
+        '''
+        Function that returns a checksum of the whole content of the table, computed by the DB, so that DropUnchangedRows can tell
+        whether the table has been written by anything else (backfill, restore, another host) since the row hashes were stored.
+
+        :param table_name: table name
+        :type: str
+        :return: checksum, None if the table does not exist
+        :rtype: str
+        '''
+
+    @abstractmethod
+    def ReadLatestSnapshot(self, table_name, expiration_date):
+        '''
+        Function that reads the rows of the latest snapshot of the table for the expiration date, as recorded in latest_snapshots.
+
+        :param table_name: table name, one of data_ingestion.schema.SNAPSHOT_COLUMNS
+        :type: str
+        :param expiration_date: expiration date as stored in the table, e.g. 'GIU22' or '2022-06-01'
+        :type: str
+        :return: rows of the latest snapshot, empty if the table has never been loaded for the expiration date
+        :rtype: pandas.DataFrame
+        '''
+
+    @abstractmethod
+    def ReadTable(self, table_name, expiration_date = None, start_date = None, end_date = None, columns = None):
+        '''
+        Function that reads the rows of the table, optionally filtered by expiration date and by a range of snapshot dates.
+
+        :param table_name: table name
+        :type: str
+        :param expiration_date: expiration date as stored in the table, e.g. 'GIU22'. Default is None, meaning all
+        :type: str
+        :param start_date: first snapshot date to read, included. Only for tables in data_ingestion.schema.SNAPSHOT_COLUMNS. Default is None, meaning no lower bound
+        :type: str or datetime
+        :param end_date: last snapshot date to read, included. Only for tables in data_ingestion.schema.SNAPSHOT_COLUMNS. Default is None, meaning no upper bound
+        :type: str or datetime
+        :param columns: columns to read. Default is None, meaning all
+        :type: list
+        :return: rows of the table
+        :rtype: pandas.DataFrame
+        '''
+
+    def _latest_snapshots(self, table_name):
+        '''
+        Function that computes the latest_snapshots rows of the DataFrame being upserted: latest snapshot date per expiration date.
+        Expiration dates stored as datetimes are formatted as yyyy-mm-dd.
+
+        :return: DataFrame with the columns of latest_snapshots, None if the table is not tracked or the DataFrame is empty
+        :rtype: pandas.DataFrame
+        '''
+        snapshot_col = SNAPSHOT_COLUMNS.get(table_name)
+        if snapshot_col is None or len(self.pandas_df) == 0:
+            return None
+
+        expiration_date = self.pandas_df['expiration_date']
+        if pd.api.types.is_datetime64_any_dtype(expiration_date):
+            expiration_date = expiration_date.dt.strftime('%Y-%m-%d')
+        df_latest = pd.DataFrame({
+            'expiration_date': expiration_date.astype(str).to_numpy(),
+            'insert_date': pd.to_datetime(self.pandas_df[snapshot_col]).to_numpy(),
+            }).groupby('expiration_date', as_index=False)['insert_date'].max()
+        df_latest.insert(0, 'table_name', table_name)
+        df_latest['update_time'] = datetime.now()
+
+        return df_latest
+
+    def _row_hashes_path(self, table_name):
+        '''
+        Path of the file storing the row hashes of the table.
+        '''
+        return '{0}/{1}.{2}.pkl'.format(self.ROW_HASHES_FOLDER, self.table_schema, table_name)
+
+    def DropUnchangedRows(self, table_name, pk, ignore_cols = ('update_time', 'insert_date')):
+        '''
+        Function that removes from the DataFrame the rows already loaded with the same content, so that they are not sent to the DB again.
+        A content hash per primary key is computed vectorized and compared with the hashes stored by the previous upserts of the table.
+        Hashes are stored only when the following UpdateInsertTable succeeds, together with the TableFingerprint of the table right after it:
+        when the table does not match that fingerprint anymore, the stored hashes are discarded and every row is sent.
+
+        :param table_name: table name stored on DB
+        :type: str
+        :param pk: primary key of the table, as returned by the DirectaDataPull.cleaning_* functions
+        :type: list
+        :param ignore_cols: columns not taken into account when comparing the content, e.g. the time of the run. Primary key columns are never ignored
+        :type: tuple
+        :return: number of rows skipped
+        :rtype: int
+        '''
+        content_cols = [col for col in self.pandas_df.columns if col not in pk and col not in ignore_cols]
+        key_hashes = pd.util.hash_pandas_object(self.pandas_df[pk], index=False).to_numpy()
+        content_hashes = pd.util.hash_pandas_object(self.pandas_df[content_cols], index=False).to_numpy()
+        row_hashes = pd.Series(content_hashes, index=key_hashes)
+
+        stored_hashes = pd.Series(dtype='uint64')
+        if os.path.isfile(self._row_hashes_path(table_name)):
+            with open(self._row_hashes_path(table_name), 'rb') as f:
+                stored = pickle.load(f)
+            # Files written before fingerprints were stored hold the bare Series and cannot be validated
+            stored_fingerprint, stored_series = stored if isinstance(stored, tuple) else (None, None)
+            fingerprint = self.TableFingerprint(table_name)
+            if stored_fingerprint is not None and stored_fingerprint == fingerprint:
+                stored_hashes = stored_series
+            else:
+                self._logging.warning("Table {0} has changed since its row hashes were stored, every row will be upserted".format(table_name))
+
+        # Keys never loaded get 0 as content hash, keeping the comparison on uint64
+        unchanged = stored_hashes.reindex(key_hashes, fill_value=0).to_numpy() == content_hashes
+        self.rows_skipped = int(unchanged.sum())
+        self.pandas_df = self.pandas_df[~unchanged]
+        row_hashes = row_hashes[~row_hashes.index.duplicated(keep='last')]
+        # Empty pieces (e.g. no hashes stored yet) are left out, pandas deprecates them in concat
+        kept_hashes = [hashes for hashes in (stored_hashes[~stored_hashes.index.isin(row_hashes.index)], row_hashes) if len(hashes) > 0]
+        self._pending_row_hashes = (table_name, pd.concat(kept_hashes) if kept_hashes else row_hashes)
+        self._logging.info("{0} unchanged rows skipped, {1} new or changed rows to upsert into {2}".format(self.rows_skipped, len(self.pandas_df), table_name))
+
+        return self.rows_skipped
+
+    def _saving_row_hashes(self):
+        '''
+        Function that stores the row hashes computed by DropUnchangedRows, once the upsert has succeeded.
+        '''
+        if self._pending_row_hashes is None:
+            return
+        table_name, row_hashes = self._pending_row_hashes
+        mkdir_p(self._row_hashes_path(table_name))
+        save_to_pickle((self.TableFingerprint(table_name), row_hashes), self._row_hashes_path(table_name))
+        self._pending_row_hashes = None
+
+    def InvalidateRowHashes(self, table_name):
+        '''
+        Function that deletes the row hashes stored for the table, so that the next DropUnchangedRows skips nothing.
+        To be called whenever the table is created or migrated, or written by anything but UpdateInsertTable (e.g. a backfill).
+
+        :param table_name: table name
+        :type: str
+        :return: None
+        '''
+        if os.path.isfile(self._row_hashes_path(table_name)):
+            os.remove(self._row_hashes_path(table_name))
+            self._logging.info("Row hashes of table {0} invalidated".format(table_name))
+
+
+def get_backend(backend, table_schema, pandas_df, save_log = True, **kwargs):
+    '''
+    Function that returns the storage backend writing pandas_df into table_schema.
+    Backends are imported only when requested, so that their drivers are needed only when used.
+
+    :param backend: 'mariadb' (DBUtils) or 'duckdb' (DuckDBUtils)
+    :type: str
+    :param table_schema: DB schema where tables are stored
+    :type: str
+    :param pandas_df: DataFrame to load
+    :type: pandas.DataFrame
+    :param kwargs: keyword arguments of the backend constructor (e.g. pool_size for mariadb, database_path for duckdb)
+    :return: storage backend object
+    :rtype: StorageBackend
+    '''
+    if backend == 'mariadb':
+        from data_ingestion.db_utils import DBUtils
+        return DBUtils(table_schema, pandas_df, save_log=save_log, **kwargs)
+    elif backend == 'duckdb':
+        from data_ingestion.duckdb_utils import DuckDBUtils
+        return DuckDBUtils(table_schema, pandas_df, save_log=save_log, **kwargs)
+    else:
+        raise ValueError("Storage backend {} is not supported | Use either 'mariadb' or 'duckdb'".format(backend))
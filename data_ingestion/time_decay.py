@@ -0,0 +1,159 @@
+import sys
+import numpy as np
+import pandas as pd
+from utils.utils import MyLogger, frame_hash
+from data_ingestion.analytics import PositionAnalytics
+from data_ingestion.parsers import parse_expiration_codes, expiration_day
+
+
+class TimeDecay:
+
+    '''
+    ## Theta decay of every strike of an expiration date, computed in one vectorized pass over a dense (snapshot x strike) matrix
+    of median prices, one matrix per option type. The option ruler history is read incrementally through PositionAnalytics
+    and results are cached per expiration date until a new snapshot is loaded.
+    '''
+
+    OPTION_TYPES = ['C', 'P']
+
+    def __init__(self, table_schema = 'directa', backend = 'mariadb', analytics = None, save_log = True):
+        '''
+        Constructor method
+
+        :param analytics: PositionAnalytics object sharing the option ruler history cache. Default is None, meaning a new one
+        :type: PositionAnalytics
+        '''
+        self.analytics = PositionAnalytics(table_schema, backend=backend, save_log=save_log) if analytics is None else analytics
+        # Results per expiration date, together with the last snapshot they were computed on
+        self._cache = {}
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/time_decay.log', name='time_decay')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='time_decay')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    @staticmethod
+    def building_matrix(history):
+        '''
+        Function that scatters the median prices of one option type into a dense matrix, one row per snapshot and one column per strike.
+        Strikes missing from a snapshot are NaN.
+
+        :param history: option ruler history of one option type, with columns insert_date, strike and median_price
+        :type: pandas.DataFrame
+        :return: snapshot dates, strikes and the matrix of median prices
+        :rtype: tuple
+        '''
+        dates, date_idx = np.unique(history['insert_date'].to_numpy(dtype='datetime64[ns]'), return_inverse=True)
+        strikes, strike_idx = np.unique(history['strike'].to_numpy(), return_inverse=True)
+        prices = np.full((len(dates), len(strikes)), np.nan)
+        prices[date_idx, strike_idx] = history['median_price'].to_numpy(dtype=float)
+
+        return dates, strikes, prices
+
+    @staticmethod
+    def computing_decay(dates, prices, expiry):
+        '''
+        Function that computes the decay measures of every strike at once.
+
+        :param dates: snapshot dates, one per row of prices
+        :type: numpy.ndarray
+        :param prices: median prices, snapshots x strikes
+        :type: numpy.ndarray
+        :param expiry: expiration day
+        :type: pandas.Timestamp
+        :return: dict of arrays, snapshots x strikes unless stated otherwise:
+            decay_curve: median price relative to the first snapshot where the strike is priced (1 at the first snapshot)
+            day_over_day: change of the median price per calendar day since the previous snapshot (NaN on the first row)
+            normalised_decay: day_over_day times the days to expiry of the previous snapshot, over its median price.
+                It is about -0.5 for at-the-money options whose value decays with the square root of time
+            days_to_expiry: calendar days to expiry of each snapshot (vector)
+            All of them are empty when there is no snapshot
+        :rtype: dict
+        '''
+        if len(dates) == 0:
+            return {
+                'decay_curve': np.empty(prices.shape), 'day_over_day': np.empty(prices.shape),
+                'normalised_decay': np.empty(prices.shape), 'days_to_expiry': np.empty(0)
+                }
+
+        # Price of each strike at the first snapshot where it is priced
+        first_valid = np.argmax(np.isfinite(prices), axis=0)
+        first_prices = prices[first_valid, np.arange(prices.shape[1])]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            decay_curve = prices / first_prices
+
+            days_to_expiry = ((pd.Timestamp(expiry).to_datetime64().astype('datetime64[D]') - dates.astype('datetime64[D]')) / np.timedelta64(1, 'D')).astype(float)
+            day_over_day = np.full_like(prices, np.nan)
+            elapsed_days = -np.diff(days_to_expiry)
+            day_over_day[1:] = np.diff(prices, axis=0) / elapsed_days[:, None]
+            normalised_decay = np.full_like(prices, np.nan)
+            normalised_decay[1:] = day_over_day[1:] * days_to_expiry[:-1, None] / prices[:-1]
+
+        return {
+            'decay_curve': decay_curve, 'day_over_day': day_over_day,
+            'normalised_decay': normalised_decay, 'days_to_expiry': days_to_expiry
+            }
+
+    def computing(self, expiration_date, expiry = None):
+        '''
+        Function that computes the decay measures of every strike and option type of the expiration date.
+        Results are recomputed only when a new snapshot has been loaded since the previous call.
+
+        :param expiration_date: expiration date as stored in daily_options, e.g. 'GIU22'
+        :type: str
+        :param expiry: expiration day. Default is None, meaning the third Friday of the expiration month
+        :type: str or datetime
+        :return: dict having the option type as key and a dict with dates, strikes, prices and the measures of computing_decay as value,
+            empty arrays for an expiration date or option type without history
+        :rtype: dict
+        '''
+        history = self.analytics.options_history(expiration_date)
+        if history.empty:
+            self._logging.warning("No option ruler history for expiration date {}, decay measures are empty".format(expiration_date))
+        # Only the last snapshot can be refreshed by a later run of the same day, so its content is part of the key
+        last_date = history['insert_date'].max()
+        cache_key = (last_date, len(history), frame_hash(history.loc[history['insert_date'] == last_date, ['strike', 'option_type', 'median_price']]))
+        cached = self._cache.get(expiration_date)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+
+        if expiry is None:
+            expiry = expiration_day(parse_expiration_codes(pd.Series([expiration_date]))).iloc[0]
+        expiry = pd.Timestamp(expiry)
+
+        results = {}
+        for option_type in self.OPTION_TYPES:
+            dates, strikes, prices = self.building_matrix(history[history['option_type'].astype(str) == option_type])
+            results[option_type] = {'dates': dates, 'strikes': strikes, 'prices': prices, **self.computing_decay(dates, prices, expiry)}
+            self._logging.info("Decay of {0} {1} computed over {2} snapshots x {3} strikes".format(expiration_date, option_type, len(dates), len(strikes)))
+
+        self._cache[expiration_date] = (cache_key, results)
+
+        return results
+
+    @staticmethod
+    def to_frame(results, measure):
+        '''
+        Function that turns one measure of computing into a long DataFrame, e.g. for plotting or exporting.
+
+        :param results: dict returned by computing
+        :type: dict
+        :param measure: one of 'prices', 'decay_curve', 'day_over_day', 'normalised_decay'
+        :type: str
+        :return: DataFrame with columns insert_date, option_type, strike and the measure
+        :rtype: pandas.DataFrame
+        '''
+        list_df = []
+        for option_type, result in results.items():
+            n_dates, n_strikes = result[measure].shape
+            list_df.append(pd.DataFrame({
+                'insert_date': np.repeat(result['dates'], n_strikes),
+                'option_type': option_type,
+                'strike': np.tile(result['strikes'], n_dates),
+                measure: result[measure].ravel(),
+                }))
+
+        return pd.concat(list_df, ignore_index=True)
@@ -0,0 +1,246 @@
+import sys
+import numpy as np
+import pandas as pd
+from utils.utils import MyLogger, frame_hash
+from data_ingestion.parsers import parse_expiration_codes, expiration_day
+from data_ingestion.pricing import time_to_expiry
+from data_ingestion.implied_vol import ImpliedVolSolver
+
+
+class VolSurface:
+
+    '''
+    ## Implied volatility surface fitted on one snapshot: a smile per expiry, total variance w = sigma^2 * T as a polynomial of the
+    log-moneyness k = ln(K / F), interpolated linearly in total variance across expiries. Queries are fully vectorized and never refit.
+    '''
+
+    # Lowest total variance returned, so that volatilities stay positive where a smile is extrapolated far from the quotes
+    MIN_TOTAL_VARIANCE = 1e-8
+
+    def __init__(self, snapshot_date, expiries, years, forwards, coefficients):
+        '''
+        Constructor method, see VolSurfaceBuilder.building
+
+        :param expiries: expiration days of the fitted smiles, sorted
+        :type: pandas.DatetimeIndex
+        :param years: years to expiry of the fitted smiles
+        :type: numpy.ndarray
+        :param forwards: forward price of each expiry
+        :type: numpy.ndarray
+        :param coefficients: polynomial coefficients of each smile, highest degree first, one row per expiry
+        :type: numpy.ndarray
+        '''
+        self.snapshot_date = snapshot_date
+        self.expiries = expiries
+        self.years = years
+        self.forwards = forwards
+        self.coefficients = coefficients
+
+    def _years(self, expiries):
+        '''
+        Function that converts expiries into years from the snapshot, numbers being taken as years already.
+        '''
+        expiries = np.asarray(expiries)
+        if np.issubdtype(expiries.dtype, np.number):
+            return expiries.astype(float)
+
+        return np.asarray(time_to_expiry(self.snapshot_date, pd.to_datetime(expiries.ravel())), dtype=float).reshape(expiries.shape)
+
+    def _smile_variance(self, expiry_index, log_moneyness):
+        '''
+        Function that evaluates the smiles of the given expiries with Horner's scheme, one expiry index per point.
+        '''
+        total_variance = np.zeros_like(log_moneyness)
+        for j in range(self.coefficients.shape[1]):
+            total_variance = total_variance * log_moneyness + self.coefficients[expiry_index, j]
+
+        return total_variance
+
+    def total_variance(self, strikes, expiries):
+        '''
+        Function that returns the total implied variance of the surface. Between two fitted expiries it is interpolated linearly in time
+        at the same log-moneyness, before the first one and after the last one the volatility of the closest smile is kept.
+
+        :param strikes: strikes
+        :type: numpy.ndarray
+        :param expiries: expiration days, or years to expiry
+        :type: numpy.ndarray
+        :return: total variance, strikes and expiries broadcast against each other
+        :rtype: numpy.ndarray
+        '''
+        strikes, years = np.broadcast_arrays(np.asarray(strikes, dtype=float), self._years(expiries))
+        years = np.maximum(years, 1e-6)
+        forwards = np.interp(years, self.years, self.forwards)
+        log_moneyness = np.log(strikes / forwards)
+
+        upper = np.clip(np.searchsorted(self.years, years), 1, max(len(self.years) - 1, 1))
+        lower = upper - 1
+        if len(self.years) == 1:
+            upper = lower = np.zeros_like(upper)
+        lower_variance = self._smile_variance(lower, log_moneyness)
+        upper_variance = self._smile_variance(upper, log_moneyness)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(upper == lower, 0.0, (years - self.years[lower]) / (self.years[upper] - self.years[lower]))
+        total_variance = lower_variance + (upper_variance - lower_variance) * weight
+        # Same volatility as the closest smile outside the fitted expiries
+        total_variance = np.where(years < self.years[0], self._smile_variance(np.zeros_like(lower), log_moneyness) * years / self.years[0], total_variance)
+        total_variance = np.where(years > self.years[-1], self._smile_variance(np.full_like(lower, len(self.years) - 1), log_moneyness) * years / self.years[-1], total_variance)
+
+        return np.maximum(total_variance, self.MIN_TOTAL_VARIANCE)
+
+    def iv(self, strikes, expiries):
+        '''
+        Function that returns the implied volatilities of the surface.
+
+        :param strikes: strikes
+        :type: numpy.ndarray
+        :param expiries: expiration days, or years to expiry
+        :type: numpy.ndarray
+        :return: annualised volatilities, strikes and expiries broadcast against each other
+        :rtype: numpy.ndarray
+        '''
+        strikes, years = np.broadcast_arrays(np.asarray(strikes, dtype=float), self._years(expiries))
+
+        return np.sqrt(self.total_variance(strikes, years) / np.maximum(years, 1e-6))
+
+
+class VolSurfaceBuilder:
+
+    '''
+    ## Build VolSurface objects from the calendar prices (several expiries per strike) and the option ruler (full chain of one expiry).
+    Forwards of the calendar expiries are implied by put-call parity, implied volatilities are solved on out-of-the-money options
+    and fitted surfaces are cached per snapshot, so that pricing and optimisation can query them without refitting.
+    '''
+
+    def __init__(self, degree = 2, solver = None, save_log = True):
+        '''
+        Constructor method
+
+        :param degree: degree of the polynomial fitted on each smile, lowered for expiries with few quotes
+        :type: int
+        :param solver: implied volatility solver. Default is None, meaning a new ImpliedVolSolver
+        :type: ImpliedVolSolver
+        '''
+        self.degree = degree
+        self.solver = ImpliedVolSolver(save_log=save_log) if solver is None else solver
+        # Fitted surfaces per snapshot date and content hash of the quotes
+        self._cache = {}
+
+        if save_log:
+            # Initiate the logging
+            self._logging = MyLogger(log_file='logs/vol_surface.log', name='vol_surface')
+        elif not save_log:
+            self._logging = MyLogger(log_file=None, name='vol_surface')
+        else:
+            sys.exit('save_log parameter has not been set correctly | Adjust accordingly to either True or False')
+
+    @staticmethod
+    def collecting_quotes(df_calendar, df_options = None):
+        '''
+        Function that stacks calendar and option ruler prices, one row per expiry, strike and option type.
+        Expiries quoted in the option ruler take its median prices instead of the calendar ones.
+
+        :param df_calendar: cleaned calendar prices, as returned by DirectaDataPull.cleaning_calendar_data
+        :type: pandas.DataFrame
+        :param df_options: cleaned option ruler of one expiration date, as returned by DirectaDataPull.cleaning_options_data. Default is None
+        :type: pandas.DataFrame
+        :return: quotes with columns expiry, strike, option_type and price
+        :rtype: pandas.DataFrame
+        '''
+        quotes = pd.DataFrame({
+            'expiry': pd.to_datetime(df_calendar['expiration_date']).dt.normalize().to_numpy(),
+            'strike': df_calendar['strike'].to_numpy(dtype=float),
+            'option_type': df_calendar['option_type'].astype(str).to_numpy(),
+            'price': df_calendar['price'].to_numpy(dtype=float),
+            })
+        if df_options is not None:
+            ruler_expiry = expiration_day(parse_expiration_codes(df_options['expiration_date'])).to_numpy()
+            quotes = pd.concat([
+                quotes[~quotes['expiry'].isin(ruler_expiry)],
+                pd.DataFrame({
+                    'expiry': ruler_expiry,
+                    'strike': df_options['strike'].to_numpy(dtype=float),
+                    'option_type': df_options['option_type'].astype(str).to_numpy(),
+                    'price': df_options['median_price'].to_numpy(dtype=float),
+                    }),
+                ], ignore_index=True)
+
+        return quotes[np.isfinite(quotes['price']) & (quotes['price'] > 0)].reset_index(drop=True)
+
+    @staticmethod
+    def implying_forwards(quotes):
+        '''
+        Function that implies the forward of each expiry by put-call parity, F = K + C - P, at the strike where call and put prices are closest.
+
+        :param quotes: quotes returned by collecting_quotes
+        :type: pandas.DataFrame
+        :return: forward indexed by expiry, missing for expiries without both a call and a put on the same strike
+        :rtype: pandas.Series
+        '''
+        pairs = quotes.pivot_table(index=['expiry', 'strike'], columns='option_type', values='price', aggfunc='last')
+        if not {'C', 'P'}.issubset(pairs.columns):
+            return pd.Series(dtype=float, name='forward')
+        pairs = pairs.dropna(subset=['C', 'P'])
+        pairs = pairs.assign(spread=(pairs['C'] - pairs['P']).abs()).reset_index()
+        atm = pairs.loc[pairs.groupby('expiry')['spread'].idxmin()]
+
+        return pd.Series((atm['strike'] + atm['C'] - atm['P']).to_numpy(), index=atm['expiry'].to_numpy(), name='forward')
+
+    def building(self, df_calendar, df_options = None, future = None, snapshot_date = None):
+        '''
+        Function that fits the surface of the snapshot, or returns it from the cache when the same quotes have already been fitted.
+
+        :param df_calendar: cleaned calendar prices, as returned by DirectaDataPull.cleaning_calendar_data
+        :type: pandas.DataFrame
+        :param df_options: cleaned option ruler of one expiration date, as returned by DirectaDataPull.cleaning_options_data. Default is None
+        :type: pandas.DataFrame
+        :param future: price of the future read from the option ruler header, used as forward of its expiry. Default is None, meaning implied by put-call parity
+        :type: float
+        :param snapshot_date: date of the snapshot. Default is None, meaning the insert_date of df_calendar
+        :type: str or datetime
+        :return: fitted surface
+        :rtype: VolSurface
+        '''
+        snapshot_date = pd.to_datetime(df_calendar['insert_date'].iloc[0] if snapshot_date is None else snapshot_date).normalize()
+        quotes = self.collecting_quotes(df_calendar, df_options)
+        cache_key = (snapshot_date, future, frame_hash(quotes))
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        forwards = self.implying_forwards(quotes)
+        if df_options is not None and future is not None:
+            forwards[expiration_day(parse_expiration_codes(df_options['expiration_date'].iloc[:1])).iloc[0]] = future
+
+        expiries, years, expiry_forwards, coefficients = [], [], [], []
+        for expiry, df_expiry in quotes.groupby('expiry'):
+            forward = forwards.get(expiry)
+            years_to_expiry = float(time_to_expiry(snapshot_date, expiry))
+            if forward is None or not np.isfinite(forward) or years_to_expiry <= 0:
+                continue
+            # Out-of-the-money options only: calls above the forward, puts below
+            df_otm = df_expiry[np.where(df_expiry['option_type'] == 'C', df_expiry['strike'] >= forward, df_expiry['strike'] < forward)]
+            sigma, converged, _ = self.solver.solving(
+                df_otm['price'].to_numpy(), forward, df_otm['strike'].to_numpy(), years_to_expiry, (df_otm['option_type'] == 'C').to_numpy()
+                )
+            if converged.sum() == 0:
+                continue
+            log_moneyness = np.log(df_otm['strike'].to_numpy()[converged] / forward)
+            total_variance = sigma[converged] ** 2 * years_to_expiry
+            degree = min(self.degree, converged.sum() - 1)
+            # Padding with leading zeros, so that every smile has the same number of coefficients
+            coefficients.append(np.pad(np.polyfit(log_moneyness, total_variance, degree), (self.degree - degree, 0)))
+            expiries.append(expiry)
+            years.append(years_to_expiry)
+            expiry_forwards.append(forward)
+
+        if not expiries:
+            raise ValueError('No expiry of the snapshot {} has enough implied volatilities to fit a smile'.format(snapshot_date.date()))
+
+        surface = VolSurface(snapshot_date, pd.DatetimeIndex(expiries), np.array(years), np.array(expiry_forwards), np.vstack(coefficients))
+        self._cache[cache_key] = surface
+        self._logging.info("Volatility surface of {0} fitted on {1} expiries: {2}".format(
+            snapshot_date.date(), len(expiries), [expiry.strftime('%Y-%m-%d') for expiry in surface.expiries]
+            ))
+
+        return surface
@@ -1,34 +1,81 @@
-from data_ingestion.db_utils import DBUtils
+import sys
+from utils.utils import MyLogger
+from data_ingestion.db_utils import upsert_tables
 from data_ingestion.directa_data_pull import DirectaDataPull
-from sqlalchemy import String, Integer, DateTime
+from data_ingestion.archive import SnapshotArchive
+from data_ingestion.portfolio import PortfolioSeries
 # import importlib, sys
 # importlib.reload(sys.modules['data_ingestion.db_utils'])
 
 
 
 if __name__ == '__main__':
-    pull_obj = DirectaDataPull(save_log=True, expiration_date_of_interest='SET22', symbol = 'FXM22')
-    pull_obj.navigating_directa(options_prices=True, options_open_positions=True, options_calendar=True, options_greeks=True)
-    df_options, pk_options = pull_obj.cleaning_options_data('options_table.csv')
-    df_open_positions, pk_open_positions = pull_obj.cleaning_tabellone_data(purchase_date='2022-03-31')
+    main_logging = MyLogger(log_file='logs/main.log', name='main')
+    # exports declares the side files written in background for this run, e.g. ('csv',) or () to skip them
+    pull_obj = DirectaDataPull(save_log=True, expiration_date_of_interest='SET22', symbol = 'FXM22', exports=('csv', 'xlsx'))
+    # all_expirations=True downloads the option ruler of every expiration date listed on Directa in the same session
+    pull_obj.navigating_directa(options_prices=True, options_open_positions=True, options_calendar=True, options_greeks=True, all_expirations=False)
+    df_options, pk_options = pull_obj.cleaning_all_options_data()
+    purchase_date = '2022-03-31'
+    df_open_positions, pk_open_positions = pull_obj.cleaning_tabellone_data(purchase_date=purchase_date)
     df_calendar, pk_calendar = pull_obj.cleaning_calendar_data()
     df_greeks, pk_greeks = pull_obj.cleaning_greeks_data()
-    pull_obj.editing_strategy_calculator(df_options, grid_shift_input=50)
-    # initiating DBUtils object for each DataFrame
-    db_class = DBUtils('directa', df_options)
-    db_class_open = DBUtils('directa', df_open_positions)
-    db_class_calendar = DBUtils('directa', df_calendar)
-    db_class_greeks = DBUtils('directa', df_greeks)
-    # Only run when table doesn't exist and it is the first run
-    db_class.LoadTable('daily_options', pk = pk_options, data_types={'strike': Integer(), 'insert_date': DateTime(), 'expiration_date': String(10), 'option_type': String(10)})
-    db_class_open.LoadTable('open_position_options', pk = pk_open_positions, data_types={'strike': Integer(), 'purchase_date': DateTime(), 'expiration_date': DateTime(), 'option_type': String(10), 'underlying_asset': String(10)})
-    db_class_calendar.LoadTable('calendar_options', pk = pk_calendar, data_types={'strike': Integer(), 'expiration_date': DateTime(), 'option_type': String(10)})
-    db_class_greeks.LoadTable('greeks_options', pk = pk_greeks, data_types={'strike': Integer(), 'option_type': String(10), 'expiration_date': DateTime(), 'insert_date': DateTime()})
-    # Upsert
-    db_class.UpdateInsertTable('daily_options')
-    db_class_open.UpdateInsertTable('open_position_options')
-    db_class_calendar.UpdateInsertTable('calendar_options')
-    db_class_greeks.UpdateInsertTable('greeks_options')
+    # Greeks are computed locally from the option ruler when nothing has been downloaded from BarChart.com (e.g. options_greeks=False)
+    if df_greeks is None and pull_obj.newest_file is None:
+        main_logging.warning("No greeks file downloaded from BarChart.com, greeks are computed locally (source 'black76')")
+        # None when the option ruler of the expiration date of interest is missing, the other tables being loaded anyway
+        df_greeks, pk_greeks = pull_obj.computing_greeks(df_options)
+    # Archiving raw files and cleaned frames, so that history is not overwritten by the next run
+    archive_obj = SnapshotArchive()
+    for csv_name in pull_obj.option_tables.values():
+        archive_obj.archiving_raw_file('data/{}'.format(csv_name), pull_obj.insert_date)
+    archive_obj.archiving_raw_file('data/tabellone.csv', pull_obj.insert_date)
+    archive_obj.archiving_raw_file('data/options_calendar.csv', pull_obj.insert_date)
+    # Session parameters the raw files depend on, read back by data_ingestion.backfill
+    archive_obj.archiving_snapshot_info(pull_obj.insert_date, expiration_date=pull_obj.expiration_date_of_interest, purchase_date=purchase_date)
+    archive_obj.writing('daily_options', df_options)
+    archive_obj.writing('open_position_options', df_open_positions)
+    archive_obj.writing('calendar_options', df_calendar)
+    if df_greeks is not None:
+        if pull_obj.newest_file is not None:
+            archive_obj.archiving_raw_file('data/greeks/{}'.format(pull_obj.newest_file), pull_obj.insert_date, sub_folder='greeks')
+        archive_obj.writing('greeks_options', df_greeks)
+    # The strategy calculator is skipped, but the tables are still upserted, when the ruler of the expiration date of interest is missing
+    df_strategy = df_options[df_options['expiration_date'] == pull_obj.expiration_date_of_interest]
+    if df_strategy.empty:
+        main_logging.error("No option ruler cleaned for the expiration date of interest {0} (cleaned: {1}) | Strategy calculator not edited".format(
+            pull_obj.expiration_date_of_interest, sorted(df_options['expiration_date'].unique())
+            ))
+    else:
+        pull_obj.editing_strategy_calculator(df_strategy, grid_shift_input=50)
+    # Upserting the tables concurrently, each one on its own pooled connection
+    # Positions and calendar are mostly identical day to day, only new or changed rows are sent
+    tables = {
+        'daily_options': (df_options, pk_options, False),
+        'open_position_options': (df_open_positions, pk_open_positions, True),
+        'calendar_options': (df_calendar, pk_calendar, True),
+        }
+    # Greeks are skipped when BarChart.com returned a file already ingested
+    if df_greeks is not None:
+        tables['greeks_options'] = (df_greeks, pk_greeks, False)
+    # backend='duckdb' stores the tables in data/duckdb/directa.duckdb, for local runs without MariaDB
+    upsert_results = upsert_tables('directa', tables, backend='mariadb')
+    for table_name, result in upsert_results.items():
+        if result['error'] is None:
+            main_logging.info("Table {0} upserted in {1:.2f} seconds: {2}".format(table_name, result['seconds'], result['stats']))
+        else:
+            main_logging.error("Upsert of table {0} failed with: {1}".format(table_name, result['error']))
+    if 'greeks_options' in upsert_results and upsert_results['greeks_options']['error'] is None:
+        pull_obj.registering_greeks_file()
+    # Appending net greeks and mark-to-market of the open positions for this snapshot
+    try:
+        PortfolioSeries(backend='mariadb').updating(df_options, df_open_positions, df_greeks, snapshot_date=pull_obj.insert_date)
+    except Exception as e:
+        main_logging.error("Portfolio time series update failed with: {}".format(e))
+    # Waiting for side files and strategy calculator, written in background while upserting
+    pull_obj.export_worker.waiting()
+    if any(result['error'] is not None for result in upsert_results.values()):
+        sys.exit('Upsert failed for some tables | Check logs/main.log')
 
     # Alternative period
     # pull_obj = DirectaDataPull(save_log=True, expiration_date_of_interest='MAR22')
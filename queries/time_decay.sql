@@ -11,7 +11,9 @@ where
 	MOD(strike, 50) = 0 and 
 	option_type  = 'P'and 
 	strike>=2800 and 
-	strike<=4150 and insert_date in (select max(insert_date) from directa.daily_options do );
+	strike<=4150 and 
+	expiration_date = 'GIU22' and 
+	insert_date = (select insert_date from directa.latest_snapshots where table_name = 'daily_options' and expiration_date = 'GIU22');
 
 -- Creating table merging daily option price and portfolio, setting expiration_date of interest
 DROP TEMPORARY TABLE IF EXISTS tempdb.tmp_options;
@@ -98,7 +100,9 @@ GROUP BY 1, 2, 3;
 SELECT 
 	SUM(IV)/SUM(CASE WHEN IV IS NOT NULL THEN 1 ELSE 0 END)
 FROM directa.greeks_options go2 
-where MONTH(expiration_date) = 6 and update_time in (SELECT MAX(update_time) from directa.greeks_options go3 ) ;
+inner join directa.latest_snapshots ls 
+	on ls.table_name = 'greeks_options' and ls.expiration_date = DATE_FORMAT(go2.expiration_date, '%Y-%m-%d') and ls.insert_date = go2.insert_date
+where MONTH(go2.expiration_date) = 6 ;
 
 -- time decay
 SELECT 	
@@ -114,7 +118,7 @@ FROM (
 	SELECT
 		*
 	FROM directa.daily_options
-	WHERE insert_date in (SELECT max(insert_date) FROM directa.daily_options WHERE expiration_date='GIU22')) as a
+	WHERE expiration_date='GIU22' and insert_date = (SELECT insert_date FROM directa.latest_snapshots WHERE table_name = 'daily_options' and expiration_date='GIU22')) as a
 LEFT JOIN (
 	SELECT
 		*
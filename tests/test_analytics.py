@@ -0,0 +1,27 @@
+import pandas as pd
+from data_ingestion.db_utils import TABLES_DATA_TYPES
+from data_ingestion.storage import get_backend
+from data_ingestion.analytics import PositionAnalytics, removing_history_cache
+
+
+def _loading_snapshot(insert_date):
+    df = pd.DataFrame({
+        'strike': [3900, 3900], 'option_type': ['C', 'P'], 'median_price': [100.0, 90.0], 'delta': [0.5, -0.5],
+        'insert_date': pd.to_datetime([insert_date] * 2), 'expiration_date': ['SET22', 'SET22'],
+        })
+    db_class = get_backend('duckdb', 'directa', df, save_log=False)
+    db_class.LoadTable('daily_options', pk=['strike', 'insert_date', 'expiration_date', 'option_type'], data_types=TABLES_DATA_TYPES['daily_options'])
+    db_class.UpdateInsertTable('daily_options')
+
+
+def test_backfilled_snapshots_read_after_removing_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _loading_snapshot('2022-03-31')
+    assert PositionAnalytics(backend='duckdb', save_log=False).options_history('SET22')['insert_date'].nunique() == 1
+
+    # Snapshot older than the cached ones, as loaded by data_ingestion.backfill
+    _loading_snapshot('2022-03-30')
+    assert PositionAnalytics(backend='duckdb', save_log=False).options_history('SET22')['insert_date'].nunique() == 1
+
+    assert removing_history_cache() == 1
+    assert PositionAnalytics(backend='duckdb', save_log=False).options_history('SET22')['insert_date'].nunique() == 2
@@ -0,0 +1,25 @@
+import pandas as pd
+from data_ingestion.archive import SnapshotArchive
+
+
+def _snapshot(insert_date, prices):
+    return pd.DataFrame({
+        'strike': [3900, 3950],
+        'option_type': ['C', 'C'],
+        'median_price': prices,
+        'insert_date': pd.to_datetime([insert_date] * 2),
+        'expiration_date': ['SET22', 'SET22'],
+        })
+
+
+def test_writing_same_day_replaces_partition(tmp_path):
+    archive_obj = SnapshotArchive(archive_dir=str(tmp_path), save_log=False)
+    archive_obj.writing('daily_options', _snapshot('2022-03-30', [100.0, 80.0]))
+    archive_obj.writing('daily_options', _snapshot('2022-03-31', [110.0, 90.0]))
+    archive_obj.writing('daily_options', _snapshot('2022-03-31', [111.0, 91.0]))
+
+    df = archive_obj.reading('daily_options').sort_values(['insert_date', 'strike'])
+
+    assert len(df) == 4
+    assert df.loc[df['insert_date'] == '2022-03-30', 'median_price'].tolist() == [100.0, 80.0]
+    assert df.loc[df['insert_date'] == '2022-03-31', 'median_price'].tolist() == [111.0, 91.0]
@@ -0,0 +1,27 @@
+import pandas as pd
+from utils.utils import MyLogger
+from data_ingestion.directa_data_pull import DirectaDataPull
+from data_ingestion.implied_vol import ImpliedVolSolver
+
+
+def _pull_obj():
+    # Object built without the constructor, which sets the Italian locale and prepares the web session
+    pull_obj = DirectaDataPull.__new__(DirectaDataPull)
+    pull_obj.expiration_date_of_interest = 'SET22'
+    pull_obj.future, pull_obj.futures = 3900.0, {}
+    pull_obj.step_timings = {}
+    pull_obj.iv_solver = ImpliedVolSolver(save_log=False)
+    pull_obj._logging = MyLogger(log_file=None, name='directa_data_pull')
+
+    return pull_obj
+
+
+def test_computing_greeks_without_expiration_of_interest():
+    df_options = pd.DataFrame({
+        'strike': [3900, 3900], 'option_type': ['C', 'P'], 'median_price': [100.0, 95.0], 'delta': [0.5, -0.5],
+        'insert_date': pd.to_datetime(['2022-03-31'] * 2), 'expiration_date': ['GIU22', 'GIU22'],
+        })
+    df_greeks, sql_pk = _pull_obj().computing_greeks(df_options)
+
+    assert df_greeks is None
+    assert sql_pk == ['strike', 'option_type', 'expiration_date', 'insert_date']
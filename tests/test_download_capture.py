@@ -0,0 +1,28 @@
+from data_ingestion.download_capture import DownloadCapture
+
+
+GREEKS_CSV = (
+    'Strike,Type,Last,IV,Delta,Gamma,Theta,Vega,IV Skew,Last Trade\n'
+    '3900.00,Call,120.50,21.3%,0.5211,0.0009,-1.2345,5.4321,0.5%,03/31/22\n'
+    '3900.00,Put,98.10,22.1%,-0.4789,0.0009,-1.1111,5.4321,1.3%,03/31/22\n'
+    )
+
+
+def test_hashing_file_ignores_footer(tmp_path):
+    first = tmp_path / 'greeks_first.csv'
+    second = tmp_path / 'greeks_second.csv'
+    first.write_text(GREEKS_CSV + '"Downloaded from Barchart.com as of 03-31-2022 05:42pm CDT"\n')
+    second.write_text(GREEKS_CSV + '"Downloaded from Barchart.com as of 03-31-2022 06:15pm CDT"\n')
+
+    assert DownloadCapture.hashing_file(str(first)) != DownloadCapture.hashing_file(str(second))
+    assert DownloadCapture.hashing_file(str(first), footer_lines=1) == DownloadCapture.hashing_file(str(second), footer_lines=1)
+
+
+def test_hashing_file_detects_content_change(tmp_path):
+    first = tmp_path / 'greeks_first.csv'
+    second = tmp_path / 'greeks_second.csv'
+    footer = '"Downloaded from Barchart.com as of 03-31-2022 05:42pm CDT"\n'
+    first.write_text(GREEKS_CSV + footer)
+    second.write_text(GREEKS_CSV.replace('120.50', '121.00') + footer)
+
+    assert DownloadCapture.hashing_file(str(first), footer_lines=1) != DownloadCapture.hashing_file(str(second), footer_lines=1)
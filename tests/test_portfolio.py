@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from data_ingestion.portfolio import PortfolioSeries
+
+
+DF_OPTIONS = pd.DataFrame({
+    'strike': [3900, 3900], 'option_type': ['C', 'P'], 'median_price': [100.0, 90.0], 'delta': [0.5, -0.5],
+    'insert_date': pd.to_datetime(['2022-03-31'] * 2), 'expiration_date': ['SET22', 'SET22'],
+    })
+DF_POSITIONS = pd.DataFrame({
+    'strike': [3900, 3900], 'option_type': ['C', 'P'], 'expiration_date': pd.to_datetime(['2022-09-01'] * 2),
+    'qty': [-1.0, 2.0], 'price': [110.0, 80.0],
+    })
+
+
+def test_computing_without_greeks_leaves_greeks_missing():
+    df_row = PortfolioSeries(save_log=False).computing(DF_OPTIONS, DF_POSITIONS, df_greeks=None)
+
+    assert df_row['net_delta'].iloc[0] == -1.5
+    assert df_row['n_with_greeks'].iloc[0] == 0
+    assert df_row[['net_gamma', 'net_theta', 'net_vega']].isna().all(axis=None)
+
+
+def test_computing_with_greeks():
+    df_greeks = DF_POSITIONS[['strike', 'option_type', 'expiration_date']].assign(delta=[0.5, -0.5], gamma=[0.001, 0.002], theta=[-1.0, -2.0], vega=[5.0, 5.0])
+    df_row = PortfolioSeries(save_log=False).computing(DF_OPTIONS, DF_POSITIONS, df_greeks=df_greeks)
+
+    assert np.isclose(df_row['net_gamma'].iloc[0], 0.003)
+    assert np.isclose(df_row['net_theta'].iloc[0], -3.0)
+    assert df_row['n_with_greeks'].iloc[0] == 2
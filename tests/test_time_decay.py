@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from data_ingestion.analytics import PositionAnalytics
+from data_ingestion.time_decay import TimeDecay
+
+
+class HistoryAnalytics:
+
+    '''
+    ## Option ruler history given in memory instead of read from the DB
+    '''
+
+    def __init__(self, history):
+        self.history = history
+
+    def options_history(self, expiration_date):
+        return self.history
+
+
+def test_computing_without_history_returns_empty_measures():
+    history = pd.DataFrame({col: [] for col in PositionAnalytics.HISTORY_COLS})
+    history['insert_date'] = pd.to_datetime(history['insert_date'])
+    results = TimeDecay(analytics=HistoryAnalytics(history), save_log=False).computing('SET22')
+
+    assert set(results) == {'C', 'P'}
+    assert results['C']['prices'].shape == (0, 0)
+    assert results['P']['days_to_expiry'].shape == (0,)
+    assert TimeDecay.to_frame(results, 'decay_curve').empty
+
+
+def test_computing_decay_of_one_option_type():
+    history = pd.DataFrame({
+        'strike': [3900, 3950, 3900, 3950], 'option_type': ['C'] * 4, 'median_price': [100.0, 80.0, 90.0, 70.0], 'delta': [0.5, 0.4, 0.5, 0.4],
+        'insert_date': pd.to_datetime(['2022-03-30', '2022-03-30', '2022-03-31', '2022-03-31']),
+        })
+    results = TimeDecay(analytics=HistoryAnalytics(history), save_log=False).computing('SET22')
+
+    assert np.allclose(results['C']['decay_curve'][1], [0.9, 0.875])
+    assert np.allclose(results['C']['day_over_day'][1], [-10.0, -10.0])
+    assert results['P']['prices'].shape == (0, 0)
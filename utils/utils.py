@@ -230,3 +230,10 @@ def nan_to_none(df):
     '''
     df_imputed = df.astype('object').where(df.notna(), None)
     return df_imputed
+
+# Content hash of a Dataframe, used in cache keys
+def frame_hash(df):
+    '''
+    Hashing the values of a Dataframe, index excluded, so that cached results are recomputed when the content changes
+    '''
+    return int(pd.util.hash_pandas_object(df, index=False).sum())